@@ -0,0 +1,4 @@
+'''Lets the book club program be run with "python code".'''
+from book_club_manager import main
+
+main()
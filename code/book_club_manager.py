@@ -1,7 +1,14 @@
 '''The main file for the book club program.'''
+import argparse
+import asyncio
+import os
+import sqlite3
 import string
+import sys
+import threading
 import time
 import random
+from concurrent.futures import ThreadPoolExecutor
 
 import google_api
 
@@ -112,6 +119,66 @@ def make_lambda(function, *args, **kwargs):
     '''Makes a static lambda fuction for some input.'''
     return lambda: function(*args, **kwargs)
 
+def fan_out(function, items, max_workers, possible_errors):
+    '''Calls function on every item using a bounded pool of worker threads.
+    Returns a dictionary of item to result and a dictionary of item to raised error.'''
+    results = {}
+    failures = {}
+    if not items:
+        return results, failures
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as executor:
+        pending = [(item, executor.submit(function, item)) for item in items]
+        for item, future in pending:
+            try:
+                results[item] = future.result()
+            except possible_errors as error:
+                failures[item] = error
+
+    return results, failures
+
+def warm_cache(book_bot, users):
+    '''Loads what the menus will need, most needed first: the user table, the history,
+    the current poll id and locations and then every user's books, starting from the lists
+    saved by an earlier run. Fills users with the User objects.
+    Anything that fails is left to be loaded when it is needed.'''
+    #any failure, even a timeout or a short row, only means that part is loaded later,
+    #and the warmer must never print a traceback in the middle of a menu
+    try:
+        user_names = book_bot.get_user_names()
+    except Exception: # pylint: disable=broad-except
+        return
+
+    #the poll itself isn't cached, so only warm the global info it starts from
+    for load_function in (book_bot.get_history, book_bot.get_current_poll_id,
+                          book_bot.get_poll_locations):
+        try:
+            load_function()
+        except Exception: # pylint: disable=broad-except
+            pass
+
+    try:
+        book_bot.load_saved_book_lists()
+    except Exception: # pylint: disable=broad-except
+        pass
+
+    try:
+        for name in user_names:
+            user_info = book_bot.get_user_info(name)
+            if user_info:
+                users.setdefault(name, user_info)
+
+        book_bot.get_books_for_users([users[name] for name in user_names if name in users])
+    except Exception: # pylint: disable=broad-except
+        pass
+
+def start_cache_warmer(book_bot, users):
+    '''Starts warm_cache in a background thread that won't keep the program open.'''
+    warmer = threading.Thread(target=warm_cache, args=(book_bot, users),
+                              name='cache-warmer', daemon=True)
+    warmer.start()
+    return warmer
+
 #----- Adapted from the work of Peter Norvig at http://norvig.com/spell-correct.html -----
 def edits1(word, letters):
     "All edits that are one edit away from `word`."
@@ -127,6 +194,28 @@ def edits2(word, letters):
     return set(e2 for e1 in edits1(word, letters) for e2 in edits1(e1, letters))
 #----- End adapted spell check code
 
+def parse_args(argv=None):
+    '''Parses the command line options.'''
+    parser = argparse.ArgumentParser(description='Manage a book club from the command line.')
+    parser.add_argument('--config', default='./book-club.conf',
+                        help='the configuration file to use (default: %(default)s)')
+    parser.add_argument('--check-config', action='store_true',
+                        help='check the configuration file and exit without connecting')
+    parser.add_argument('--import-report', action='store_true',
+                        help='report how long the deferred Google client imports take and exit')
+    return parser.parse_args(argv)
+
+def print_import_report():
+    '''Imports each module google_api defers and prints how long each one took.'''
+    print('Modules imported at startup: %d' % (len(sys.modules)))
+    print('Deferred imports:')
+    total_time = 0
+    for lazy_module in google_api.LazyModule.modules:
+        lazy_module.load()
+        total_time += lazy_module.import_time
+        print('%8.1f ms  %s' % (lazy_module.import_time * 1000, lazy_module.name))
+    print('%8.1f ms  total' % (total_time * 1000))
+
 def get_conf(file_name):
     '''Makes a configuration dictionary out of a file.'''
     try:
@@ -147,13 +236,21 @@ def get_conf(file_name):
     conf_file.close()
     return conf
 
-if __name__ == '__main__':
+def main(argv=None):
+    '''Runs the book club manager.'''
     #----- Initialization -----
+    ARGS = parse_args(argv)
+    if ARGS.import_report:
+        print_import_report()
+        return
+
     USERS = {}
 
-    CONF = get_conf('./book-club.conf')
+    CONF = get_conf(ARGS.config)
     if not CONF:
         print('Error opening configuration file')
+        if ARGS.check_config:
+            exit(1)
         input('Press enter to exit')
         exit()
 
@@ -199,12 +296,55 @@ if __name__ == '__main__':
         print('Missing configuration: OPTION_NUM')
         INCORRECT_CONF = True
 
+    FETCH_WORKERS = google_api.ConcurrencyLimiter.max_limit
+    if 'FETCH_WORKERS' in CONF:
+        try:
+            FETCH_WORKERS = int(CONF['FETCH_WORKERS'])
+        except ValueError:
+            print('Invalid configuration: FETCH_WORKERS')
+            INCORRECT_CONF = True
+
+    RATE_LIMITS = {}
+    for api in google_api.RateLimiter.default_limits:
+        conf_name = 'RATE_LIMIT_' + api.upper()
+        if conf_name in CONF:
+            #none turns the limit off
+            if CONF[conf_name].lower() == 'none':
+                RATE_LIMITS[api] = None
+                continue
+
+            try:
+                RATE_LIMITS[api] = int(CONF[conf_name])
+            except ValueError:
+                RATE_LIMITS[api] = 0
+
+            if RATE_LIMITS[api] <= 0:
+                print('Invalid configuration: %s' % (conf_name))
+                INCORRECT_CONF = True
+
     if INCORRECT_CONF:
+        if ARGS.check_config:
+            exit(1)
         input('Press enter to exit')
         exit()
 
+    if ARGS.check_config:
+        print('Configuration is valid')
+        return
+
+    #opening the disk cache creates it, so --check-config stops before this
+    DISK_CACHE = None
+    DISK_CACHE_PATH = CONF.get('DISK_CACHE_PATH', os.path.join(google_api.get_credential_dir(),
+                                                               'book-club-cache.sqlite'))
+    if DISK_CACHE_PATH.lower() != 'none':
+        try:
+            DISK_CACHE = google_api.DiskCache(DISK_CACHE_PATH)
+        except sqlite3.Error:
+            print('Unable to open the disk cache, continuing without it')
+
     BOOK_BOT = google_api.GoogleDocsBot(CRED_PATH, CLINT_SECRET_PATH,
-                                        CRED_NAME, SCRIPT_ID)
+                                        CRED_NAME, SCRIPT_ID, RATE_LIMITS, DISK_CACHE)
+    ASYNC_BOT = google_api.AsyncGoogleDocsBot(BOOK_BOT, max(1, FETCH_WORKERS))
 
     BC_EXISTS = False
     try:
@@ -226,6 +366,14 @@ if __name__ == '__main__':
             print('First-time setup failed')
             input('Press enter to exit')
             exit()
+
+    try:
+        BOOK_BOT.refresh_changes()
+        BOOK_BOT.load_snapshot()
+    except (google_api.errors.HttpError, google_api.SpreadsheetFormatError):
+        print('Failed to preload book club information, it will be loaded when needed')
+
+    start_cache_warmer(BOOK_BOT, USERS)
     #----- End Initialization -----
 
     #----- External Functionality -----
@@ -273,8 +421,12 @@ if __name__ == '__main__':
         for row in history:
             not_allowed_set.add((row[1], row[2], row[3]))
 
+        #every user's books are requested first, so any not yet loaded arrive in one batch
+        for user in users:
+            user.request_books()
+
         options = []
-        users.sort(key=lambda user: user.get_book_count())
+        users.sort(key=lambda user: len(user.get_books()))
         for user in users:
             books = user.get_books().copy()
             selection = None
@@ -311,24 +463,39 @@ if __name__ == '__main__':
             print('Failed to retrieve list of users')
             return
 
-        fail_count = 0
+        async def email_users():
+            '''Fetches any missing users, then sends every email at once.'''
+            missing_names = [name for name in user_names if not name in USERS]
+            user_infos = await asyncio.gather(
+                *[ASYNC_BOT.get_user_info(name) for name in missing_names],
+                return_exceptions=True)
 
-        for name in user_names:
-            valid_user = True
-            if not name in USERS:
-                try:
-                    USERS[name] = BOOK_BOT.get_user_info(name)
-                except possible_errors:
+            fail_count = 0
+            for name, user_info in zip(missing_names, user_infos):
+                if isinstance(user_info, possible_errors):
                     print("Failed to retrieve %s's info" % (name))
-                    valid_user = False
                     fail_count += 1
+                elif isinstance(user_info, BaseException):
+                    raise user_info
+                else:
+                    USERS[name] = user_info
 
-            if valid_user:
-                try:
-                    BOOK_BOT.send_email(USERS[name].get_user_email(), subject, body)
-                except possible_errors:
+            valid_names = [name for name in user_names if name in USERS]
+            email_results = await asyncio.gather(
+                *[ASYNC_BOT.send_email(USERS[name].get_user_email(), subject, body)
+                  for name in valid_names],
+                return_exceptions=True)
+
+            for name, email_result in zip(valid_names, email_results):
+                if isinstance(email_result, possible_errors):
                     print('Failed to email %s' % (name))
                     fail_count += 1
+                elif isinstance(email_result, BaseException):
+                    raise email_result
+
+            return fail_count
+
+        fail_count = asyncio.run(email_users())
 
         percent = 100 * (1 - (fail_count / len(user_names)))
         print('%4.1f%% of users emailed successfully' % (percent))
@@ -358,9 +525,8 @@ if __name__ == '__main__':
             print('Failed to retrieve list of users')
             return
 
-        users_with_books = []
+        #start fetching every missing user, all read from the one cached user table
         for name in user_names:
-            valid_user = True
             if not name in USERS:
                 try:
                     USERS[name] = BOOK_BOT.get_user_info(name)
@@ -369,18 +535,29 @@ if __name__ == '__main__':
                     if not continue_with_user(name):
                         print('Poll creation suspended')
                         return
+        #end fetching every missing user code
 
-                    valid_user = False
+        users = [USERS[name] for name in user_names if name in USERS]
 
-            if valid_user:
-                try:
-                    if BOOK_BOT.get_user_books(USERS[name]):
-                        users_with_books.append(USERS[name])
-                except possible_errors:
-                    print("Failed to retrieve %s's books" % (name))
-                    if not continue_with_user(name):
-                        print('Poll creation suspended')
-                        return
+        #start fetching every user's books, one call at a time if the bulk call fails
+        try:
+            books = BOOK_BOT.get_books_for_users(users)
+        except possible_errors:
+            user_books = fan_out(BOOK_BOT.get_user_books, users,
+                                 FETCH_WORKERS, possible_errors)[0]
+            books = {user.get_user_name(): user_books[user] for user in user_books}
+        #end fetching every user's books code
+
+        users_with_books = []
+        for user in users:
+            name = user.get_user_name()
+            if not name in books:
+                print("Failed to retrieve %s's books" % (name))
+                if not continue_with_user(name):
+                    print('Poll creation suspended')
+                    return
+            elif books[name]:
+                users_with_books.append(user)
 
         if len(users_with_books) < OPTION_NUM:
             print('Not enough users with books to create a poll')
@@ -626,11 +803,14 @@ if __name__ == '__main__':
                            google_api.AppsScriptError,
                            google_api.SpreadsheetFormatError)
         try:
-            books = BOOK_BOT.get_user_books(user)
+            books = BOOK_BOT.get_user_books(user, allow_stale=True)
         except possible_errors:
             print('Failed to retrieve books')
             books = []
 
+        if BOOK_BOT.pop_stale_flag():
+            print('(These books may be out of date, they are being refreshed in the background)')
+
         book_delete_options = []
 
         for book in books:
@@ -646,18 +826,21 @@ if __name__ == '__main__':
                            google_api.AppsScriptError,
                            google_api.SpreadsheetFormatError)
         try:
-            user_names = BOOK_BOT.get_user_names()
+            user_names = BOOK_BOT.get_user_names(allow_stale=True)
         except possible_errors:
             print('Failed to retrieve user list')
             user_names = []
 
+        if BOOK_BOT.pop_stale_flag():
+            print('(This list may be out of date, it is being refreshed in the background)')
+
         user_menus = []
 
         for name in user_names:
             valid_user = True
             if not name in USERS:
                 try:
-                    USERS[name] = BOOK_BOT.get_user_info(name)
+                    USERS[name] = BOOK_BOT.get_user_info(name, allow_stale=True)
                 except possible_errors:
                     print("Failed to retrieve %s's info" % (name))
                     valid_user = False
@@ -698,4 +881,12 @@ if __name__ == '__main__':
     #----- End Define Menu Structure -----
 
     while True:
+        try:
+            BOOK_BOT.refresh_changes()
+        except (google_api.errors.HttpError, google_api.AppsScriptError):
+            print('Failed to check for changes, some information may be out of date')
+
         TOP_LEVEL.execute()
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,9 @@
 '''This file contains the shared classes used by the book-selector project.'''
 
+import asyncio
 import random
+import threading
+import time
 from abc import ABC, abstractmethod
 
 class Book:
@@ -82,9 +85,12 @@ class User:
         if isinstance(books, list) and (not books or isinstance(books[0], Book)):
             self.books = books
             self.book_count = len(books)
+            self.books_loaded = bool(books)
         else:
             raise TypeError("Provided book list not a list of books.")
 
+        self.book_loader = None
+
         if isinstance(form_link, str):
             self.form_link = form_link
         else:
@@ -96,12 +102,33 @@ class User:
             raise TypeError("Provided data io interface not a DataIO object.")
 
     def get_books(self):
-        '''Returns the list of books suggested by this user.'''
-        if not self.books:
-            self.data_io.get_user_books(self)
+        '''Returns the list of books suggested by this user, loading them the first time.
+        Loads requested by other users are done in the same batch.'''
+        if not self.books_loaded:
+            if self.book_loader is not None:
+                self.book_loader.load(self)
+                self.book_loader.dispatch()
+            else:
+                self.data_io.get_user_books(self)
 
         return self.books
 
+    def request_books(self):
+        '''Asks for this user's books to be loaded with the next batch, if they aren't yet.'''
+        if not self.books_loaded and self.book_loader is not None:
+            self.book_loader.load(self)
+
+    def is_books_loaded(self):
+        '''Returns whether this user's books have been loaded, even if there are none.'''
+        return self.books_loaded
+
+    def set_book_loader(self, book_loader):
+        '''Sets the loader used to load this user's books in batches.'''
+        if isinstance(book_loader, BookLoader) or book_loader is None:
+            self.book_loader = book_loader
+        else:
+            raise TypeError("Provided book loader not a BookLoader object.")
+
     def get_user_name(self):
         '''Returns the user's username.'''
         return self.user_name
@@ -123,6 +150,7 @@ class User:
         if isinstance(new_books, list) and (not new_books or isinstance(new_books[0], Book)):
             self.books = new_books
             self.book_count = len(new_books)
+            self.books_loaded = True
         else:
             raise TypeError("Provided book list not a list of books.")
 
@@ -174,6 +202,7 @@ class Poll:
 
     def __init__(self, options, scores, form_link, form_id, date_created, data_io):
         self.winner = None
+        self.response_count = None
 
         if isinstance(options, list) and (not options or isinstance(options[0], Book)):
             self.options = options
@@ -235,11 +264,14 @@ class Poll:
         '''Returns the date the poll was created.'''
         return self.date_created
 
+    def get_response_count(self):
+        '''Returns the number of responses as of the last update, or None if never updated.'''
+        return self.response_count
+
     def update_results(self):
         '''Changes the results to those of the current poll.
         Removes the cached winner if it exists.'''
-        current_poll = self.data_io.get_current_poll()
-        self.scores = current_poll.scores
+        self.scores, self.response_count = self.data_io.get_poll_scores(self.form_id)
 
         if hasattr(self, 'winner'):
             self.winner = None
@@ -283,6 +315,16 @@ class DataIO(ABC):
         Also updates the user object's books.'''
         raise NotImplementedError('Abstract method "get_user_books" not implemented')
 
+    def get_books_for_users(self, users):
+        '''Fetches the books of many users, updating each user object's books.
+        Returns a dictionary of user names to book lists. Backends that can fetch in bulk
+        should override this, leaving out users whose books could not be retrieved.'''
+        books = {}
+        for user in users:
+            books[user.get_user_name()] = self.get_user_books(user)
+
+        return books
+
     @abstractmethod
     def get_history(self):
         '''Abstract method. Returns the list of books that have won in the past.'''
@@ -293,6 +335,15 @@ class DataIO(ABC):
         '''Abstract method. Returns the ongoing poll.'''
         raise NotImplementedError('Abstract method "get_current_poll" not implemented')
 
+    def get_poll_scores(self, poll_id):
+        '''Returns the scores of a poll and the number of responses it has received.
+        Backends should override this with something lighter than building the whole poll.'''
+        current_poll = self.get_current_poll()
+        if current_poll is None or current_poll.form_id != poll_id:
+            raise ValueError('Scores are only available for the current poll.')
+
+        return current_poll.scores, sum(current_poll.scores)
+
     @abstractmethod
     def create_user(self, username, user_email):
         '''Abstract method. Creates a new user and returns it.'''
@@ -337,3 +388,396 @@ class DataIO(ABC):
     def delete_poll(self, poll_id):
         '''Abstract method. Removes a poll.'''
         raise NotImplementedError('Abstract method "delete_poll" not implemented')
+
+class CachingDataIO(DataIO):
+    '''A DataIO that remembers the reads of another DataIO and forgets them on writes.
+    Users and books passing through are pointed at this object, so their own reads and
+    writes are cached too. Values older than max_age seconds, if provided, are read again.'''
+
+    def __init__(self, data_io, max_age=None):
+        super().__init__()
+
+        if isinstance(data_io, DataIO):
+            self.data_io = data_io
+        else:
+            raise TypeError("Provided data io interface not a DataIO object.")
+
+        self.max_age = max_age
+        self.book_loader = BookLoader(self)
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.lock = threading.RLock()
+
+    def lookup(self, key):
+        '''Returns whether there is a current value for key, and the value.'''
+        with self.lock:
+            if key in self.values:
+                stored_at, value = self.values[key]
+                if self.max_age is None or time.monotonic() - stored_at <= self.max_age:
+                    self.hits += 1
+                    return True, value
+
+            self.misses += 1
+            return False, None
+
+    def store(self, key, value):
+        '''Remembers value under key.'''
+        with self.lock:
+            self.values[key] = (time.monotonic(), value)
+
+    def invalidate(self, *keys):
+        '''Forgets the values stored under keys.'''
+        with self.lock:
+            for key in keys:
+                if key in self.values:
+                    del self.values[key]
+                    self.invalidations += 1
+
+    def get_stats(self):
+        '''Returns a dictionary of the hit, miss and invalidation counts and the current size.'''
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'invalidations': self.invalidations,
+                    'size': len(self.values)}
+
+    def adopt_user(self, user):
+        '''Points a user, and its books, at this object.'''
+        if isinstance(user, User):
+            user.data_io = self
+            if user.book_loader is not None:
+                user.set_book_loader(self.book_loader)
+            self.adopt_books(user.books)
+
+        return user
+
+    def adopt_books(self, books):
+        '''Points books at this object.'''
+        for book in books:
+            book.data_io = self
+
+        return books
+
+    def get_user_names(self):
+        '''Returns the cached list of user names, reading it the first time.'''
+        found, user_names = self.lookup(('user_names',))
+        if not found:
+            user_names = self.data_io.get_user_names()
+            self.store(('user_names',), user_names)
+
+        return user_names
+
+    def get_user_info(self, username):
+        '''Returns the cached User object for a user name, reading it the first time.'''
+        found, user = self.lookup(('user', username))
+        if not found:
+            user = self.adopt_user(self.data_io.get_user_info(username))
+            self.store(('user', username), user)
+
+        return user
+
+    def get_user_books(self, user):
+        '''Returns a user's cached books, reading them the first time, and updates the user.'''
+        found, books = self.lookup(('books', user.get_user_name()))
+        if found:
+            user.replace_books(books)
+        else:
+            books = self.adopt_books(self.data_io.get_user_books(user))
+            self.store(('books', user.get_user_name()), books)
+
+        return books
+
+    def get_books_for_users(self, users):
+        '''Returns the books of many users, reading the ones not cached in one batch.'''
+        books = {}
+        missing_users = []
+        for user in users:
+            found, user_books = self.lookup(('books', user.get_user_name()))
+            if found:
+                user.replace_books(user_books)
+                books[user.get_user_name()] = user_books
+            else:
+                missing_users.append(user)
+
+        if missing_users:
+            fetched_books = self.data_io.get_books_for_users(missing_users)
+            for username, user_books in fetched_books.items():
+                self.store(('books', username), self.adopt_books(user_books))
+            books.update(fetched_books)
+
+        return books
+
+    def get_history(self):
+        '''Returns the cached winner history, reading it the first time.'''
+        found, history = self.lookup(('history',))
+        if not found:
+            history = self.data_io.get_history()
+            self.store(('history',), history)
+
+        return history
+
+    def get_current_poll(self):
+        '''Returns the cached current poll, reading it the first time.'''
+        found, poll = self.lookup(('poll',))
+        if not found:
+            poll = self.data_io.get_current_poll()
+            if poll is not None:
+                poll.data_io = self
+                self.adopt_books(poll.options)
+            self.store(('poll',), poll)
+
+        return poll
+
+    def get_poll_scores(self, poll_id):
+        '''Returns the scores of a poll. Scores change too often to be cached.'''
+        return self.data_io.get_poll_scores(poll_id)
+
+    def create_user(self, username, user_email):
+        '''Creates a new user and forgets the cached user names.'''
+        try:
+            return self.adopt_user(self.data_io.create_user(username, user_email))
+        finally:
+            self.invalidate(('user_names',), ('user', username))
+
+    def remove_book(self, book):
+        '''Deletes a book and forgets the cached book lists holding it.'''
+        #only the book lists holding this book are forgotten
+        with self.lock:
+            keys = [key for key, (_, value) in self.values.items() if key[0] == 'books'
+                    and any(book is other for other in value)]
+
+        try:
+            return self.data_io.remove_book(book)
+        finally:
+            self.invalidate(*keys)
+
+    def remove_all_books(self, user):
+        '''Deletes all of a user's books and forgets their cached book list.'''
+        try:
+            return self.data_io.remove_all_books(user)
+        finally:
+            self.invalidate(('books', user.get_user_name()))
+
+    def new_poll(self, options):
+        '''Creates a new poll and forgets the cached current poll.'''
+        try:
+            return self.data_io.new_poll(options)
+        finally:
+            self.invalidate(('poll',))
+
+    def close_poll(self, poll):
+        '''Closes a poll and forgets the cached current poll.'''
+        try:
+            return self.data_io.close_poll(poll)
+        finally:
+            self.invalidate(('poll',))
+
+    def add_winner(self, book):
+        '''Adds a book to the winner history and forgets the cached history.'''
+        try:
+            return self.data_io.add_winner(book)
+        finally:
+            self.invalidate(('history',))
+
+    def send_email(self, destination_address, subject, body):
+        '''Sends an email. Nothing cached is affected.'''
+        return self.data_io.send_email(destination_address, subject, body)
+
+    def remove_user(self, user):
+        '''Removes a user and forgets everything cached about them.'''
+        username = user.get_user_name()
+        try:
+            return self.data_io.remove_user(user)
+        finally:
+            self.invalidate(('user_names',), ('user', username), ('books', username))
+
+    def delete_poll(self, poll_id):
+        '''Removes a poll and forgets the cached current poll.'''
+        try:
+            return self.data_io.delete_poll(poll_id)
+        finally:
+            self.invalidate(('poll',))
+
+class AsyncDataIO(ABC):
+    '''An abstract class representing the functions to communicate with a DB from asyncio code.
+    Every method is a coroutine, otherwise the contract matches DataIO.'''
+
+    @abstractmethod
+    def __init__(self):
+        pass
+
+    @abstractmethod
+    async def get_user_names(self):
+        '''Abstract method. Returns a list of user names.'''
+        raise NotImplementedError('Abstract method "get_user_names" not implemented')
+
+    @abstractmethod
+    async def get_user_info(self, username):
+        '''Abstract method. Returns a populated (except for the books) User object.'''
+        raise NotImplementedError('Abstract method "get_user_info" not implemented')
+
+    @abstractmethod
+    async def get_user_books(self, user):
+        '''Abstract method. Returns the list of books that belong to a user.
+        Also updates the user object's books.'''
+        raise NotImplementedError('Abstract method "get_user_books" not implemented')
+
+    async def get_books_for_users(self, users):
+        '''Fetches the books of many users at once, updating each user object's books.
+        Returns a dictionary of user names to book lists.'''
+        book_lists = await asyncio.gather(*[self.get_user_books(user) for user in users])
+        return {user.get_user_name(): books for user, books in zip(users, book_lists)}
+
+    @abstractmethod
+    async def get_history(self):
+        '''Abstract method. Returns the list of books that have won in the past.'''
+        raise NotImplementedError('Abstract method "get_history" not implemented')
+
+    @abstractmethod
+    async def get_current_poll(self):
+        '''Abstract method. Returns the ongoing poll.'''
+        raise NotImplementedError('Abstract method "get_current_poll" not implemented')
+
+    @abstractmethod
+    async def create_user(self, username, user_email):
+        '''Abstract method. Creates a new user and returns it.'''
+        raise NotImplementedError('Abstract method "create_user" not implemented')
+
+    @abstractmethod
+    async def remove_book(self, book):
+        '''Abstract method. Deletes a book, wherever it is stored.'''
+        raise NotImplementedError('Abstract method "remove_book" not implemented')
+
+    @abstractmethod
+    async def remove_all_books(self, user):
+        '''Abstract method. Deletes all user's books wherever it is stored.'''
+        raise NotImplementedError('Abstract method "remove_all_books" not implemented')
+
+    @abstractmethod
+    async def new_poll(self, options):
+        '''Abstract method. Creates a new poll.'''
+        raise NotImplementedError('Abstract method "new_poll" not implemented')
+
+    @abstractmethod
+    async def close_poll(self, poll):
+        '''Abstract method. Stops a poll from accepting new responses.'''
+        raise NotImplementedError('Abstract method "close_poll" not implemented')
+
+    @abstractmethod
+    async def add_winner(self, book):
+        '''Abstract method. Adds a book to the winner history.'''
+        raise NotImplementedError('Abstract method "add_winner" not implemented')
+
+    @abstractmethod
+    async def send_email(self, destination_address, subject, body):
+        '''Abstract method. Sends an email, used to convey account info.'''
+        raise NotImplementedError('Abstract method "send_email" not implemented')
+
+    @abstractmethod
+    async def remove_user(self, user):
+        '''Abstract method. Removes all record of a user.'''
+        raise NotImplementedError('Abstract method "remove_user" not implemented')
+
+    @abstractmethod
+    async def delete_poll(self, poll_id):
+        '''Abstract method. Removes a poll.'''
+        raise NotImplementedError('Abstract method "delete_poll" not implemented')
+
+class BookLoader:
+    '''A class that collects the users whose books are needed and loads them in one batch.'''
+
+    def __init__(self, data_io):
+        if isinstance(data_io, DataIO):
+            self.data_io = data_io
+        else:
+            raise TypeError("Provided data io interface not a DataIO object.")
+
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def load(self, user):
+        '''Queues a user's books to be loaded by the next dispatch.'''
+        with self.lock:
+            if not user.is_books_loaded() and not any(user is other for other in self.pending):
+                self.pending.append(user)
+
+    def dispatch(self):
+        '''Loads the books of every queued user. Users whose books could not be
+        retrieved stay unloaded. Returns the number of users loaded.'''
+        with self.lock:
+            users = self.pending
+            self.pending = []
+
+        if not users:
+            return 0
+
+        if len(users) == 1:
+            self.data_io.get_user_books(users[0])
+        else:
+            self.data_io.get_books_for_users(users)
+
+        return sum(1 for user in users if user.is_books_loaded())
+
+class IdentityMap:
+    '''A class that keeps one User object per username and one Book object per key.
+    Reading the same user or book again updates the existing object in place.
+    New users are given book_loader, if one is provided.'''
+
+    def __init__(self, book_loader=None):
+        self.users = {}
+        self.books = {}
+        self.book_keys = {}
+        self.book_loader = book_loader
+        self.lock = threading.Lock()
+
+    def get_user(self, user_name, user_email, form_link, data_io):
+        '''Returns the user with this username, creating it or updating its details.'''
+        with self.lock:
+            user = self.users.get(user_name)
+            if user is None:
+                user = User(user_name, user_email, [], form_link, data_io)
+                user.set_book_loader(self.book_loader)
+                self.users[user_name] = user
+            else:
+                user.user_email = user_email
+                user.form_link = form_link
+
+        return user
+
+    def get_book(self, key, title, author_first_name, author_last_name, location_gen, data_io):
+        '''Returns the book stored under key, creating it or updating its details.
+        location_gen is only called to make the location of a new book.'''
+        with self.lock:
+            book = self.books.get(key)
+            if book is None:
+                book = Book(title, author_first_name, author_last_name, location_gen(), data_io)
+                self.books[key] = book
+                self.book_keys[id(book)] = key
+            else:
+                book.title = title
+                book.author_first_name = author_first_name
+                book.author_last_name = author_last_name
+
+        return book
+
+    def forget_user(self, user_name):
+        '''Forgets the user with this username, along with their books.'''
+        with self.lock:
+            user = self.users.pop(user_name, None)
+
+        if user is not None:
+            self.forget_books(user.books)
+
+    def forget_books(self, books):
+        '''Forgets each of the given books.'''
+        if not books:
+            return
+
+        with self.lock:
+            for book in books:
+                key = self.book_keys.get(id(book))
+                if key is not None and self.books.get(key) is book:
+                    del self.books[key]
+                    del self.book_keys[id(book)]
@@ -1,5 +1,6 @@
 '''This is the unit test file for the books-common.py file.'''
 
+import asyncio
 import unittest
 import books_common
 
@@ -132,6 +133,127 @@ class BaseDataIOReturnPoll(BaseDataIOWithoutErrorInit):
     def get_current_poll(self):
         return self.poll
 
+class BaseDataIOReturnScores(BaseDataIOWithoutErrorInit):
+    def __init__(self, scores):
+        self.scores = scores
+
+    def get_poll_scores(self, poll_id):
+        return self.scores, sum(self.scores)
+
+class DataIOCountLoads(BaseDataIOWithoutErrorInit):
+    '''Counts the single and batched book loads, giving the user named "empty" no books'''
+
+    def __init__(self):
+        self.single_loads = 0
+        self.batch_loads = 0
+
+    def make_books(self, user):
+        if user.get_user_name() == 'empty':
+            return []
+        return [books_common.Book("Title", "Sarah", "Smith", None, self)]
+
+    def get_user_books(self, user):
+        self.single_loads += 1
+        user.replace_books(self.make_books(user))
+        return user.books
+
+    def get_books_for_users(self, users):
+        self.batch_loads += 1
+        for user in users:
+            user.replace_books(self.make_books(user))
+        return {user.get_user_name(): user.books for user in users}
+
+class DataIOCountReads(DataIOCountLoads):
+    '''Counts every read, and writes succeed'''
+
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def get_user_names(self):
+        self.reads += 1
+        return ["uName"]
+
+    def get_user_info(self, username):
+        self.reads += 1
+        return books_common.User(username, "an.email@example.com", [], "www.example.com", self)
+
+    def get_history(self):
+        self.reads += 1
+        return []
+
+    def get_current_poll(self):
+        self.reads += 1
+        return None
+
+    def create_user(self, username, user_email):
+        return books_common.User(username, user_email, [], "www.example.com", self)
+
+    def remove_book(self, book):
+        return True
+
+    def remove_all_books(self, user):
+        user.replace_books([])
+        return True
+
+    def add_winner(self, book):
+        return True
+
+    def remove_user(self, user):
+        return True
+
+class BaseAsyncDataIOWithoutErrorInit(books_common.AsyncDataIO):
+    def __init__(self):
+        pass
+
+    async def get_user_names(self):
+        return await super().get_user_names()
+
+    async def get_user_info(self, username):
+        return await super().get_user_info(username)
+
+    async def get_user_books(self, user):
+        return await super().get_user_books(user)
+
+    async def get_history(self):
+        return await super().get_history()
+
+    async def get_current_poll(self):
+        return await super().get_current_poll()
+
+    async def create_user(self, username, user_email):
+        return await super().create_user(username, user_email)
+
+    async def remove_book(self, book):
+        return await super().remove_book(book)
+
+    async def remove_all_books(self, user):
+        return await super().remove_all_books(user)
+
+    async def new_poll(self, options):
+        return await super().new_poll(options)
+
+    async def close_poll(self, poll):
+        return await super().close_poll(poll)
+
+    async def add_winner(self, book):
+        return await super().add_winner(book)
+
+    async def send_email(self, destination_address, subject, body):
+        return await super().send_email(destination_address, subject, body)
+
+    async def remove_user(self, user):
+        return await super().remove_user(user)
+
+    async def delete_poll(self, doc_id):
+        return await super().delete_poll(doc_id)
+
+class AsyncDataIOBooks(BaseAsyncDataIOWithoutErrorInit):
+    async def get_user_books(self, user):
+        books = [books_common.Book("Title", "Sarah", "Smith", None, BaseDataIOWithoutErrorInit())]
+        user.replace_books(books)
+        return books
+
 ## End test implementations
 
 class TestBookMethods(unittest.TestCase):
@@ -273,6 +395,20 @@ class TestUserMethods(unittest.TestCase):
         self.assertEqual(len(maybe_books), 1)
         self.assertTrue(maybe_books[0].compare(self.t_books[0]))
 
+    def test_get_books_loaded_empty(self):
+        data_io = DataIOCountLoads()
+        user = books_common.User("empty", self.t_userEmail, [], self.t_formLink, data_io)
+        self.assertFalse(user.is_books_loaded())
+
+        self.assertEqual(user.get_books(), [])
+        self.assertEqual(user.get_books(), [])
+        self.assertTrue(user.is_books_loaded())
+        self.assertEqual(data_io.single_loads, 1)
+
+    def test_set_book_loader_fail_bad_loader(self):
+        with self.assertRaises(TypeError):
+            self.t_user.set_book_loader(self.t_data_io)
+
     def test_get_user_name(self):
         self.assertEqual(self.t_user.get_user_name(), self.t_userName)
 
@@ -487,6 +623,15 @@ class TestPollMethods(unittest.TestCase):
         for i in range(len(testPoll.scores)):
             self.assertEqual(newScores[i], testPoll.scores[i])
 
+    def test_update_results_scores_only(self):
+        newScores = [3, 1, 2]
+        testPoll = books_common.Poll(self.t_options, [0, 0, 0], self.t_formLink, self.t_formId, self.t_dateCreated, BaseDataIOReturnScores(newScores))
+
+        self.assertIsNone(testPoll.get_response_count())
+        testPoll.update_results()
+        self.assertEqual(testPoll.scores, newScores)
+        self.assertEqual(testPoll.get_response_count(), 6)
+
     def test_delete(self):
         self.assertTrue(self.t_succeed_poll.delete())
         self.assertFalse(self.t_fail_poll.delete())
@@ -533,6 +678,11 @@ class TestDataIOMethods(unittest.TestCase):
     def test_get_current_poll(self):
         self.assertRaises(NotImplementedError, self.testIO.get_current_poll)
 
+    def test_get_poll_scores(self):
+        testIO = BaseDataIOReturnPoll(self.testPoll)
+        self.assertEqual(testIO.get_poll_scores("4800063"), ([0, 0], 0))
+        self.assertRaises(ValueError, testIO.get_poll_scores, "other id")
+
     def test_create_user(self):
         self.assertRaises(NotImplementedError, self.testIO.create_user, "uName", "user@email.com")
 
@@ -557,5 +707,218 @@ class TestDataIOMethods(unittest.TestCase):
     def test_delete_poll(self):
         self.assertRaises(NotImplementedError, self.testIO.delete_poll, 'doc_id')
 
+class TestAsyncDataIOMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.testIO = BaseAsyncDataIOWithoutErrorInit()
+
+    def tearDown(self):
+        del self.testIO
+
+    def test_init(self):
+        with self.assertRaises(TypeError):
+            testVar = books_common.AsyncDataIO()
+
+    def test_get_user_names(self):
+        self.assertRaises(NotImplementedError, asyncio.run, self.testIO.get_user_names())
+
+    def test_send_email(self):
+        self.assertRaises(NotImplementedError, asyncio.run, self.testIO.send_email('test@email.com', 'subject', 'body'))
+
+    def test_get_books_for_users(self):
+        users = [books_common.User(name, "an.email@example.com", [], "www.example.com", BaseDataIOWithoutErrorInit())
+                 for name in ["uName1", "uName2"]]
+        books = asyncio.run(AsyncDataIOBooks().get_books_for_users(users))
+
+        self.assertEqual(sorted(books.keys()), ["uName1", "uName2"])
+        for user in users:
+            self.assertEqual(user.get_book_count(), 1)
+            self.assertIs(books[user.get_user_name()], user.books)
+
+class TestBookLoaderMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.t_data_io = DataIOCountLoads()
+        self.t_loader = books_common.BookLoader(self.t_data_io)
+        self.t_users = [books_common.User(name, "an.email@example.com", [], "www.example.com", self.t_data_io)
+                        for name in ["uName1", "uName2", "empty"]]
+        for user in self.t_users:
+            user.set_book_loader(self.t_loader)
+
+    def tearDown(self):
+        del self.t_data_io
+        del self.t_loader
+        del self.t_users
+
+    def test_init_fail_bad_data_io(self):
+        with self.assertRaises(TypeError):
+            books_common.BookLoader(None)
+
+    def test_batch(self):
+        for user in self.t_users:
+            user.request_books()
+        self.t_users[0].request_books()
+        self.assertEqual(len(self.t_loader.pending), 3)
+
+        self.assertEqual(len(self.t_users[0].get_books()), 1)
+        self.assertEqual(self.t_users[2].get_books(), [])
+        self.assertEqual(self.t_data_io.batch_loads, 1)
+        self.assertEqual(self.t_data_io.single_loads, 0)
+        self.assertEqual(self.t_loader.pending, [])
+
+    def test_single(self):
+        self.assertEqual(len(self.t_users[1].get_books()), 1)
+        self.assertEqual(self.t_data_io.single_loads, 1)
+        self.assertEqual(self.t_data_io.batch_loads, 0)
+
+    def test_dispatch(self):
+        self.assertEqual(self.t_loader.dispatch(), 0)
+        for user in self.t_users:
+            self.t_loader.load(user)
+        self.assertEqual(self.t_loader.dispatch(), 3)
+
+        self.t_loader.load(self.t_users[2])
+        self.assertEqual(self.t_loader.pending, [])
+
+class TestCachingDataIOMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.t_backend = DataIOCountReads()
+        self.t_data_io = books_common.CachingDataIO(self.t_backend)
+
+    def tearDown(self):
+        del self.t_backend
+        del self.t_data_io
+
+    def test_init_fail_bad_data_io(self):
+        with self.assertRaises(TypeError):
+            books_common.CachingDataIO(None)
+
+    def test_memoized_reads(self):
+        for _ in range(3):
+            self.t_data_io.get_user_names()
+            self.t_data_io.get_history()
+            self.t_data_io.get_current_poll()
+            user = self.t_data_io.get_user_info("uName")
+
+        self.assertEqual(self.t_backend.reads, 4)
+        self.assertIs(user.data_io, self.t_data_io)
+        self.assertEqual(self.t_data_io.get_stats(), {'hits': 8, 'misses': 4, 'invalidations': 0, 'size': 4})
+
+    def test_max_age(self):
+        data_io = books_common.CachingDataIO(self.t_backend, max_age=-1)
+        data_io.get_history()
+        data_io.get_history()
+        self.assertEqual(self.t_backend.reads, 2)
+
+    def test_get_user_books(self):
+        user = self.t_data_io.get_user_info("uName")
+        first_books = self.t_data_io.get_user_books(user)
+        user.replace_books([])
+        self.assertIs(self.t_data_io.get_user_books(user), first_books)
+        self.assertIs(user.books, first_books)
+        self.assertIs(first_books[0].data_io, self.t_data_io)
+        self.assertEqual(self.t_backend.single_loads, 1)
+
+    def test_get_books_for_users(self):
+        users = [self.t_data_io.get_user_info(name) for name in ["uName1", "uName2"]]
+        self.t_data_io.get_user_books(users[0])
+        books = self.t_data_io.get_books_for_users(users)
+        self.assertEqual(sorted(books.keys()), ["uName1", "uName2"])
+        self.t_data_io.get_books_for_users(users)
+        self.assertEqual(self.t_backend.single_loads, 1)
+        self.assertEqual(self.t_backend.batch_loads, 1)
+
+    def test_create_user(self):
+        self.t_data_io.get_user_names()
+        user = self.t_data_io.create_user("new", "an.email@example.com")
+        self.assertIs(user.data_io, self.t_data_io)
+        self.t_data_io.get_user_names()
+        self.assertEqual(self.t_backend.reads, 2)
+
+    def test_remove_book(self):
+        users = [self.t_data_io.get_user_info(name) for name in ["uName1", "uName2"]]
+        self.t_data_io.get_books_for_users(users)
+        self.assertTrue(self.t_data_io.remove_book(users[0].books[0]))
+        self.assertEqual(self.t_data_io.get_stats()['invalidations'], 1)
+        books = self.t_data_io.get_books_for_users(users)
+        self.assertEqual(sorted(books.keys()), ["uName1", "uName2"])
+        self.assertEqual(self.t_backend.batch_loads, 2)
+
+    def test_remove_all_books(self):
+        user = self.t_data_io.get_user_info("uName")
+        self.t_data_io.get_user_books(user)
+        self.t_data_io.remove_all_books(user)
+        self.t_data_io.get_user_books(user)
+        self.assertEqual(self.t_backend.single_loads, 2)
+
+    def test_add_winner(self):
+        self.t_data_io.get_history()
+        self.t_data_io.add_winner(None)
+        self.t_data_io.get_history()
+        self.assertEqual(self.t_backend.reads, 2)
+
+    def test_remove_user(self):
+        user = self.t_data_io.get_user_info("uName")
+        self.t_data_io.get_user_names()
+        self.t_data_io.remove_user(user)
+        self.assertEqual(self.t_data_io.get_stats()['size'], 0)
+
+class TestIdentityMapMethods(unittest.TestCase):
+
+    def setUp(self):
+        self.t_map = books_common.IdentityMap()
+        self.t_data_io = BaseDataIOWithoutErrorInit()
+        self.t_user = self.t_map.get_user("uName", "an.email@example.com", "www.example.com", self.t_data_io)
+        self.t_book = self.t_map.get_book("key", "title", "fName", "lName", BaseLocationWithoutErrorInit, self.t_data_io)
+
+    def tearDown(self):
+        del self.t_map
+        del self.t_data_io
+        del self.t_user
+        del self.t_book
+
+    def test_get_user(self):
+        same_user = self.t_map.get_user("uName", "new.email@example.com", "www.example.com", self.t_data_io)
+        self.assertIs(same_user, self.t_user)
+        self.assertEqual(self.t_user.get_user_email(), "new.email@example.com")
+
+        other_user = self.t_map.get_user("other", "an.email@example.com", "www.example.com", self.t_data_io)
+        self.assertIsNot(other_user, self.t_user)
+
+    def test_get_book(self):
+        same_book = self.t_map.get_book("key", "new title", "fName", "lName", None, self.t_data_io)
+        self.assertIs(same_book, self.t_book)
+        self.assertEqual(self.t_book.get_title(), "new title")
+
+        other_book = self.t_map.get_book("other", "title", "fName", "lName", BaseLocationWithoutErrorInit, self.t_data_io)
+        self.assertIsNot(other_book, self.t_book)
+
+    def test_book_loader(self):
+        self.assertIsNone(self.t_user.book_loader)
+
+        loader = books_common.BookLoader(self.t_data_io)
+        loader_map = books_common.IdentityMap(loader)
+        user = loader_map.get_user("uName", "an.email@example.com", "www.example.com", self.t_data_io)
+        self.assertIs(user.book_loader, loader)
+
+    def test_forget_books(self):
+        self.t_map.forget_books([])
+        self.assertIs(self.t_map.books["key"], self.t_book)
+
+        unknown_book = books_common.Book("title", "fName", "lName", None, self.t_data_io)
+        self.t_map.forget_books([unknown_book])
+        self.assertIs(self.t_map.books["key"], self.t_book)
+
+        self.t_map.forget_books([self.t_book])
+        self.assertEqual(self.t_map.books, {})
+        self.assertEqual(self.t_map.book_keys, {})
+
+    def test_forget_user(self):
+        self.t_user.replace_books([self.t_book])
+        self.t_map.forget_user("uName")
+        self.assertEqual(self.t_map.users, {})
+        self.assertEqual(self.t_map.books, {})
+
 if __name__ == '__main__':
     unittest.main()
@@ -135,6 +135,25 @@ function getBookList(form_id) {
   return books;
 }
 
+/**
+ * Reads responses from many book forms at once.
+ * A form that can't be read maps to null instead of failing the whole call.
+ */
+
+function getBookLists(form_ids) {
+  var book_lists = {};
+  
+  for (var i = 0; i < form_ids.length; i++) {
+    try {
+      book_lists[form_ids[i]] = getBookList(form_ids[i]);
+    } catch (e) {
+      book_lists[form_ids[i]] = null;
+    }
+  }
+  
+  return book_lists;
+}
+
 /**
  * Removes a response from a book form
  * A little odd because as of writing there is no apps script function for deleting only one form response.
@@ -187,23 +206,42 @@ function getPollInfo(form_id) {
   pollInfo.date.month = dateCreated.getMonth() + 1;
   pollInfo.date.day = dateCreated.getDate();
   
+  var pollScores = getPollScores(form_id, form);
+  pollInfo.options = pollScores.options;
+  pollInfo.scores = pollScores.scores;
+  
+  return pollInfo;
+}
+
+/**
+ * Gets only the options and scores of a book poll, along with the number of responses.
+ * An already opened form can be passed in to avoid opening it again.
+ */
+
+function getPollScores(form_id, opt_form) {
+  var form = opt_form || FormApp.openById(form_id);
+  var pollScores = {};
+  
   var question = form.getItems()[0].asMultipleChoiceItem();
   var choices = question.getChoices();
-  pollInfo.options = [];
-  pollInfo.scores = [];
+  pollScores.options = [];
+  pollScores.scores = [];
   for (var i = 0; i < choices.length; i++) {
-    pollInfo.options.push(choices[i].getValue().toString());
-    pollInfo.scores.push(0);
+    pollScores.options.push(choices[i].getValue().toString());
+    pollScores.scores.push(0);
   }
   
   var responses = form.getResponses();
   for (var i = 0; i < responses.length; i++) {
     var choice = responses[i].getItemResponses()[0].getResponse().toString();
-    var index = pollInfo.options.indexOf(choice);
-    pollInfo.scores[index]++;
+    var index = pollScores.options.indexOf(choice);
+    if (index != -1) {
+      pollScores.scores[index]++;
+    }
   }
+  pollScores.responseCount = responses.length;
   
-  return pollInfo;
+  return pollScores;
 }
 
 /**
@@ -1,19 +1,66 @@
 '''An implementation of data storage and manipulation for a book club management program.'''
 import os
 import time
+import asyncio
+import datetime
+import functools
+import importlib
+import json
+import random
+import sqlite3
 import string
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 
-import httplib2
+try:
+    import fcntl
+except ImportError: #fcntl is only available on unix
+    fcntl = None
 
-from apiclient import discovery
-from apiclient import errors
+import books_common
 
-from oauth2client.service_account import ServiceAccountCredentials
-from oauth2client import client
-from oauth2client.file import Storage
-from oauth2client import tools
+class LazyModule():
+    '''A stand-in for a module that is only imported when one of its attributes is first used.
+    The Google client libraries are slow to import, so they wait until they are needed.'''
 
-import books_common
+    modules = []
+
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+        self.import_time = None
+        LazyModule.modules.append(self)
+
+    def load(self):
+        '''Imports the module if it hasn't been yet, and returns it.'''
+        if self.module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(self.name)
+            self.import_time = time.perf_counter() - start
+            self.module = module
+
+        return self.module
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+httplib2 = LazyModule('httplib2')
+discovery = LazyModule('apiclient.discovery')
+errors = LazyModule('apiclient.errors')
+service_account = LazyModule('oauth2client.service_account')
+client = LazyModule('oauth2client.client')
+oauth2_file = LazyModule('oauth2client.file')
+tools = LazyModule('oauth2client.tools')
+
+def get_credential_dir():
+    '''Returns the directory used to store credentials and other saved state.'''
+
+    home_dir = os.path.expanduser('~')
+    credential_dir = os.path.join(home_dir, '.credentials')
+    if not os.path.exists(credential_dir):
+        os.makedirs(credential_dir)
+    return credential_dir
 
 def get_credentials(credential_name, client_secret_file, scopes, application_name):
     '''Gets valid user credentials from storage.
@@ -25,13 +72,9 @@ def get_credentials(credential_name, client_secret_file, scopes, application_nam
         Credentials, the obtained credential.
     '''
 
-    home_dir = os.path.expanduser('~')
-    credential_dir = os.path.join(home_dir, '.credentials')
-    if not os.path.exists(credential_dir):
-        os.makedirs(credential_dir)
-    credential_path = os.path.join(credential_dir, credential_name)
+    credential_path = os.path.join(get_credential_dir(), credential_name)
 
-    store = Storage(credential_path)
+    store = oauth2_file.Storage(credential_path)
     credentials = store.get()
     if not credentials or credentials.invalid:
         flow = client.flow_from_clientsecrets(client_secret_file, scopes)
@@ -39,24 +82,418 @@ def get_credentials(credential_name, client_secret_file, scopes, application_nam
         credentials = tools.run_flow(flow, store)
     return credentials
 
-def try_request_n_retries(request, times, retry_time=1):
-    '''Tries a request up to some number of times. Only retries on failure.'''
+class FileLock():
+    '''A lock shared by every process using the same lock file.
+    Where file locks aren't available it only locks out other threads in this process.'''
+
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.Lock()
+        self.lock_file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        if fcntl is not None:
+            try:
+                self.lock_file = open(self.path, 'a')
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            except OSError:
+                if self.lock_file is not None:
+                    self.lock_file.close()
+                self.lock_file = None
+                self.thread_lock.release()
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.lock_file is not None:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+            self.lock_file = None
+        self.thread_lock.release()
+
+class TokenRefresher():
+    '''A class that refreshes stored OAuth credentials in the background before they expire.
+
+    Refreshes hold a lock on a file next to the stored credentials, and the credentials
+    reread the file before refreshing, so processes sharing the file share one refresh.'''
+
+    margin = 5 * 60
+    retry_delay = 60
+
+    def __init__(self, credentials, credential_path):
+        self.credentials = credentials
+        self.lock = FileLock(credential_path + '.lock')
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def get_delay(self):
+        '''Returns the number of seconds until the credentials should be refreshed,
+        or None if they don't expire.'''
+        token_expiry = self.credentials.token_expiry
+        if token_expiry is None:
+            return None
+
+        #oauth2client keeps expiry times as naive UTC datetimes
+        refresh_time = token_expiry - datetime.timedelta(seconds=self.margin)
+        return max(0, (refresh_time - datetime.datetime.utcnow()).total_seconds())
+
+    def refresh(self):
+        '''Refreshes the credentials if they are close to expiring. Returns whether they were.'''
+        with self.lock:
+            if self.get_delay() != 0:
+                return False
+
+            self.credentials.refresh(httplib2.Http())
+
+        return True
+
+    def run(self):
+        '''Refreshes the credentials ahead of each expiry until stopped.'''
+        while not self.stopped.is_set():
+            delay = self.get_delay()
+            if delay is None:
+                return
+
+            if delay > 0:
+                self.stopped.wait(delay)
+                continue
+
+            try:
+                self.refresh()
+            except (client.Error, httplib2.HttpLib2Error, OSError):
+                pass #a request that finds the token expired still refreshes it
+
+            if self.get_delay() == 0:
+                self.stopped.wait(self.retry_delay)
+
+    def start(self):
+        '''Starts refreshing in a background thread that won't keep the program open.'''
+        self.thread = threading.Thread(target=self.run, name='token-refresher', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        '''Stops refreshing.'''
+        self.stopped.set()
+
+def try_request_n_retries(request, times, retry_time=1, policy=None):
+    '''Tries a request up to some number of times. Only retries on transient failures.
+    If a retry policy is provided, it replaces times and retry_time.'''
+
+    if policy is None:
+        policy = RetryPolicy(max_tries=times, base_delay=retry_time)
+
+    return policy.execute(request)
+
+class RetryPolicy():
+    '''A class that decides whether and when a failed request is tried again.
+
+    Errors that can't succeed on a retry are raised immediately. Other errors are retried
+    with exponential backoff and jitter, waiting at least as long as the server's
+    Retry-After header asks, until max_tries or the deadline (in seconds) is reached.
+    If refused_only is set, only errors saying that the request was turned away before it
+    ran are retried, so calls that must not happen twice can use it.'''
+
+    transient_statuses = (408, 429, 500, 502, 503, 504)
+    rate_limit_reasons = (b'rateLimitExceeded', b'userRateLimitExceeded')
+    permanent_script_messages = ('Script function not found',
+                                 'Requested entity was not found',
+                                 'does not have permission')
+
+    def __init__(self, max_tries=5, base_delay=1, max_delay=32, deadline=None,
+                 transient_statuses=None, refused_only=False):
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.refused_only = refused_only
+
+        if transient_statuses is not None:
+            self.transient_statuses = tuple(transient_statuses)
+
+    def is_transient(self, error):
+        '''Returns whether retrying might fix the error.'''
+        if isinstance(error, errors.HttpError):
+            if error.resp.status in self.transient_statuses:
+                return True
+
+            #Drive reports going over quota as 403 rather than 429
+            content = error.content or b''
+            for reason in self.rate_limit_reasons:
+                if error.resp.status == 403 and reason in content:
+                    return True
+
+            return False
+
+        if isinstance(error, AppsScriptError):
+            message = str(error)
+
+            #a script error could have come after the script made changes, unless it was refused
+            if self.refused_only:
+                for overload_message in ConcurrencyLimiter.overload_messages:
+                    if overload_message in message:
+                        return True
+
+                return False
+
+            for permanent_message in self.permanent_script_messages:
+                if permanent_message in message:
+                    return False
+
+            return True
+
+        return False
+
+    def get_delay(self, attempt, error):
+        '''Returns how many seconds to wait after the given failed attempt, starting at 1.'''
+        backoff = min(self.max_delay, self.base_delay * (2 ** (attempt - 1)))
+        delay = random.uniform(backoff / 2, backoff)
+
+        if isinstance(error, errors.HttpError):
+            retry_after = error.resp.get('retry-after')
+            if retry_after is not None:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass #Dates are allowed too, but Google sends seconds.
+
+        return delay
+
+    def execute(self, request, before_attempt=None):
+        '''Executes a request, retrying it as the policy allows.
+        If provided, before_attempt is called before every attempt.'''
+        start = time.monotonic()
+
+        for attempt in range(1, self.max_tries + 1):
+            try:
+                if before_attempt is not None:
+                    before_attempt()
+
+                result = request.execute()
+
+                #batch requests return nothing, their results go to callbacks
+                if isinstance(result, dict) and 'error' in result:
+                    error = result['error']['details'][0]
+                    raise AppsScriptError(error)
+
+            except (errors.HttpError, AppsScriptError) as error:
+                if attempt == self.max_tries or not self.is_transient(error):
+                    raise
+
+                delay = self.get_delay(attempt, error)
+                if self.deadline is not None and time.monotonic() - start + delay > self.deadline:
+                    raise
+
+                time.sleep(delay)
+            else:
+                return result
+
+def get_request_api(request):
+    '''Returns the name of the quota a request counts against.
+    One of drive, sheets_read, sheets_write, appsscript or gmail.'''
+
+    uri = getattr(request, 'uri', '')
 
-    for i in range(1, times + 1):
+    if 'script.googleapis.com' in uri:
         try:
-            result = request.execute()
+            function_name = json.loads(request.body).get('function')
+        except (TypeError, ValueError):
+            function_name = None
+
+        if function_name in RateLimiter.gmail_functions:
+            return 'gmail'
+        return 'appsscript'
+
+    if 'sheets.googleapis.com' in uri:
+        if getattr(request, 'method', 'GET') == 'GET':
+            return 'sheets_read'
+        return 'sheets_write'
+
+    return 'drive'
+
+class TokenBucket():
+    '''A class that allows a steady number of requests per minute, plus short bursts.
+    By default a burst is a tenth of the per minute rate, so a full bucket can't use up a
+    whole minute of quota at once.'''
+
+    def __init__(self, rate_per_minute, capacity=None):
+        if rate_per_minute <= 0:
+            raise ValueError("Provided rate not a positive number.")
+
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity if capacity is not None else max(1, rate_per_minute // 10)
+        self.tokens = self.capacity
+        self.last_update = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        '''Takes a token if one is available. Returns how many seconds to wait otherwise.'''
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last_update) * self.rate)
+            self.last_update = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        '''Waits until a token is available and takes it.'''
+        wait = self.try_acquire()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+class RateLimiter():
+    '''A class holding one token bucket for each quota used by the bot.'''
+
+    gmail_functions = ('sendEmail',)
+    default_limits = {'drive': 600,
+                      'sheets_read': 60,
+                      'sheets_write': 60,
+                      'appsscript': 120,
+                      'gmail': 20}
+
+    def __init__(self, limits=None):
+        all_limits = dict(self.default_limits)
+        all_limits.update(limits or {})
+
+        self.buckets = {}
+        for api, rate_per_minute in all_limits.items():
+            if rate_per_minute is not None:
+                self.buckets[api] = TokenBucket(rate_per_minute)
+
+    def acquire(self, api):
+        '''Waits until a request against the named quota is allowed.'''
+        if api in self.buckets:
+            self.buckets[api].acquire()
+
+class ConcurrencyLimiter():
+    '''A class limiting how many requests run at once, finding the limit by itself.
+
+    The limit grows by about one for every limit's worth of quick, successful requests and
+    is cut by backoff_ratio whenever the server says too much is running (AIMD).'''
+
+    initial_limit = 4
+    min_limit = 1
+    max_limit = 30
+    target_latency = 10
+    backoff_ratio = 0.5
+    overload_statuses = (429,)
+    overload_messages = ('too many simultaneous invocations',
+                         'Service invoked too many times',
+                         'Rate Limit Exceeded')
+
+    def __init__(self):
+        self.limit = self.initial_limit
+        self.in_flight = 0
+        self.condition = threading.Condition()
 
-            if 'error' in result:
-                error = result['error']['details'][0]
-                raise AppsScriptError(error)
+    def get_limit(self):
+        '''Returns how many requests are currently allowed to run at once.'''
+        with self.condition:
+            return int(self.limit)
 
-        except (errors.HttpError, AppsScriptError):
-            if i == times: #It's the last possible try
-                raise
+    def is_overload(self, error):
+        '''Returns whether an error means that too much is running at once.'''
+        if isinstance(error, errors.HttpError):
+            return error.resp.status in self.overload_statuses
+
+        message = str(error)
+        for overload_message in self.overload_messages:
+            if overload_message in message:
+                return True
+
+        return False
+
+    def acquire(self):
+        '''Waits until another request is allowed to run.'''
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, error=None):
+        '''Records that a request finished and adjusts the limit.'''
+        with self.condition:
+            self.in_flight -= 1
+
+            if error is not None and self.is_overload(error):
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+            elif error is None and latency <= self.target_latency:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            self.condition.notify_all()
+
+class LimitedRequest():
+    '''A class wrapping a request so that executing it goes through a concurrency limiter.'''
+
+    def __init__(self, request, limiter):
+        self.request = request
+        self.limiter = limiter
+
+    def execute(self):
+        '''Executes the wrapped request once a slot is free.
+        Any exception counts as a failure, so a timeout never raises the limit.'''
+        self.limiter.acquire()
+        start = time.monotonic()
+        error = None
+        try:
+            result = self.request.execute()
+            if isinstance(result, dict) and 'error' in result:
+                error = AppsScriptError(result['error']['details'][0])
+            return result
+        except Exception as request_error:
+            error = request_error
+            raise
+        finally:
+            self.limiter.release(time.monotonic() - start, error)
+
+class SingleFlight():
+    '''A class that lets concurrent identical calls share one execution.
+    Callers that ask for a key while it is in flight wait for the same result or exception.
+    shared_calls counts the calls that were saved this way.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.shared_calls = 0
+
+    def do(self, key, function, *args):
+        '''Returns function(*args), or the result of the call already running for key.'''
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = Future()
+                self.calls[key] = call
             else:
-                time.sleep(retry_time)
+                self.shared_calls += 1
+
+        if not leader:
+            return call.result()
+
+        try:
+            result = function(*args)
+        except BaseException as error:
+            call.set_exception(error)
+            raise
         else:
+            call.set_result(result)
             return result
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+def make_service_builder(service, credentials):
+    '''Returns a function that builds a copy of a service with its own authorized http client.
+    Reuses the service's discovery document, so building a copy makes no requests.'''
+
+    root_desc = service._rootDesc #Only way to reuse the discovery document. pylint: disable=protected-access
+    return lambda: discovery.build_from_document(
+        root_desc, http=credentials.authorize(httplib2.Http()))
 
 def column_number_to_letter(column_number):
     '''Converts a column number to the column letters used by the Google apis.'''
@@ -69,6 +506,20 @@ def column_number_to_letter(column_number):
         unconverted_part = int((unconverted_part - letter_index - 1) / 26)
     return column_letter
 
+def get_row_windows(row_count, first_size, growth):
+    '''Splits the rows of a sheet into windows that grow geometrically in size.
+    Returns a list of (first row, last row) pairs, both inclusive.'''
+
+    windows = []
+    range_start = 1
+    size = max(first_size, 1)
+    while range_start <= row_count:
+        range_end = min(range_start + size - 1, row_count)
+        windows.append((range_start, range_end))
+        range_start = range_end + 1
+        size *= growth
+    return windows
+
 def get_a1_notation(sheet_name, col1, row1, col2, row2):
     '''Converts coordinates to the appropriate notation.'''
 
@@ -77,6 +528,13 @@ def get_a1_notation(sheet_name, col1, row1, col2, row2):
     a1_notation += column_number_to_letter(col2) + str(row2)
     return a1_notation
 
+def get_columns_a1_notation(sheet_name, col1, col2):
+    '''Converts a range of whole columns to the appropriate notation.'''
+
+    a1_notation = "'" + sheet_name + "'!"
+    a1_notation += column_number_to_letter(col1) + ':' + column_number_to_letter(col2)
+    return a1_notation
+
 class AppsScriptError(Exception):
     '''An error in the Google Apps Script script.'''
     pass
@@ -106,35 +564,200 @@ class Services():
         return self._appsscript
 
 
-class Cache():
-    '''A class to hold information that might be needed many times.'''
+class ThreadLocalServices(Services):
+    '''A class to hold authorized services that are built separately for each thread.
+    The http clients used by the services are not thread-safe, so they are never shared.'''
 
-    def __init__(self):
-        self.cache = {}
+    def __init__(self, drive_builder, sheets_builder, appsscript_builder):
+        super().__init__(None, None, None)
+        self.builders = {'drive': drive_builder,
+                         'sheets': sheets_builder,
+                         'appsscript': appsscript_builder}
+        self.local = threading.local()
 
-    def is_fresh(self, name):
-        '''Checks if there is a fresh value for the named variable'''
-        if name in self.cache:
-            return self.cache[name][0]
+    def get_service(self, name):
+        '''Returns the named service for the current thread, building it if needed.'''
+        service = getattr(self.local, name, None)
+        if service is None:
+            service = self.builders[name]()
+            setattr(self.local, name, service)
 
-        return False
+        return service
+
+    def seed(self, drive_service, sheets_service, appsscript_service):
+        '''Uses already built services for the current thread, instead of building them.'''
+        self.local.drive = drive_service
+        self.local.sheets = sheets_service
+        self.local.appsscript = appsscript_service
 
-    def set_value(self, name, value):
-        '''Adds named value to the cache and makes it fresh.'''
-        self.cache[name] = (True, value)
+    def drive(self):
+        '''Returns the drive service.'''
+        return self.get_service('drive')
+
+    def sheets(self):
+        '''Returns the sheets service.'''
+        return self.get_service('sheets')
+
+    def appsscript(self):
+        '''Returns the appsscript service.'''
+        return self.get_service('appsscript')
+
+class Cache():
+    '''A class to hold information that might be needed many times.
+    Hold the lock while changing a cached value in place.
+
+    Values can expire after a time to live, and the least recently used values are evicted
+    once there are more than max_size of them. Pinned names are never evicted and don't count
+    towards max_size. Checking freshness counts as a hit or a miss.'''
+
+    def __init__(self, max_size=None, default_ttl=None, pinned=()):
+        self.cache = OrderedDict()
+        self.pinned = frozenset(pinned)
+        self.stored_at = {}
+        self.expires_at = {}
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def is_fresh(self, name, max_age=None):
+        '''Checks if there is a fresh value for the named variable.
+        If max_age is provided, values stored more than max_age seconds ago are not fresh.'''
+        with self.lock:
+            fresh = name in self.cache and self.cache[name][0]
+
+            if fresh:
+                now = time.monotonic()
+                if self.expires_at.get(name) is not None and now >= self.expires_at[name]:
+                    old_value = self.cache[name][1]
+                    self.cache[name] = (False, old_value)
+                    fresh = False
+                elif max_age is not None and now - self.stored_at[name] > max_age:
+                    fresh = False
+
+            if fresh:
+                self.hits += 1
+                self.cache.move_to_end(name)
+            else:
+                self.misses += 1
+
+            return fresh
+
+    def set_value(self, name, value, ttl=None):
+        '''Adds named value to the cache and makes it fresh.
+        The value expires after ttl seconds, or the default time to live if not provided.'''
+        with self.lock:
+            if ttl is None:
+                ttl = self.default_ttl
+
+            now = time.monotonic()
+            self.cache[name] = (True, value)
+            self.cache.move_to_end(name)
+            self.stored_at[name] = now
+            self.expires_at[name] = now + ttl if ttl is not None else None
+
+            while (self.max_size is not None and
+                   len(self.cache) - len(self.pinned.intersection(self.cache)) > self.max_size):
+                old_name = next(name for name in self.cache if name not in self.pinned)
+                del self.cache[old_name]
+                del self.stored_at[old_name]
+                del self.expires_at[old_name]
+                self.evictions += 1
 
     def get_value(self, name):
         '''Returns named value if it's fresh.'''
-        if name in self.cache and self.cache[name][0]:
-            return self.cache[name][1]
+        with self.lock:
+            if name in self.cache and self.cache[name][0]:
+                expires_at = self.expires_at.get(name)
+                if expires_at is None or time.monotonic() < expires_at:
+                    return self.cache[name][1]
+
+        return None
+
+    def get_stale(self, name):
+        '''Returns named value even if it's no longer fresh, or None if it was never stored.'''
+        with self.lock:
+            if name in self.cache:
+                return self.cache[name][1]
 
         return None
 
     def timeout_var(self, name):
         '''Times out the named variable.'''
-        if name in self.cache:
-            old_value = self.cache[name][1]
-            self.cache[name] = (False, old_value)
+        with self.lock:
+            if name in self.cache:
+                old_value = self.cache[name][1]
+                self.cache[name] = (False, old_value)
+
+    def forget(self, name):
+        '''Removes the named variable, so not even a stale value is left.'''
+        with self.lock:
+            if name in self.cache:
+                del self.cache[name]
+                del self.stored_at[name]
+                del self.expires_at[name]
+
+    def get_stats(self):
+        '''Returns a dictionary of the hit, miss and eviction counts and the current size.'''
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self.cache)}
+
+class DiskCache():
+    '''A class to keep cached values on disk between runs, in a SQLite database.
+    Every value is saved with a version, and is only returned for the same version.'''
+
+    schema_version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS entries ('
+                                    'name TEXT PRIMARY KEY, schema_version INTEGER, '
+                                    'version TEXT, value TEXT)')
+
+    def get(self, name, version):
+        '''Returns the named value if it was saved with the given version, otherwise None.'''
+        if version is None:
+            return None
+
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT value FROM entries WHERE name = ? AND schema_version = ? AND version = ?',
+                (name, self.schema_version, str(version))).fetchone()
+
+        if row is None:
+            return None
+
+        return json.loads(row[0])
+
+    def set(self, name, value, version):
+        '''Saves the named value along with its version. Unversioned values are not saved.'''
+        if version is None:
+            self.delete(name)
+            return
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                (name, self.schema_version, str(version), json.dumps(value)))
+
+    def delete(self, name):
+        '''Forgets the named value.'''
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM entries WHERE name = ?', (name,))
+
+    def close(self):
+        '''Closes the database.'''
+        with self.lock:
+            self.connection.close()
 
 class FormLocation(books_common.Location):
     '''A class representing where a book is stored when used with GoogleDocsBot.'''
@@ -181,6 +804,8 @@ class GoogleDocsBot(books_common.DataIO):
                         'https://www.googleapis.com/auth/userinfo.email']
 
     info_spread_names = ('BookClubInfo', 'Users', 'History', 'GlobalInfo')
+    spreadsheet_mime_type = 'application/vnd.google-apps.spreadsheet'
+    sheet_id_extension = '.sheet_id'
     user_sheet_width = 4
     history_sheet_width = 4
     poll_id_position = (1, 1)
@@ -189,67 +814,186 @@ class GoogleDocsBot(books_common.DataIO):
     book_club_sheet_id = 'book_club_sheet_id'
     user_table = 'user_table'
     history = 'history'
+    current_poll_id = 'current_poll_id'
+    poll_locations = 'poll_locations'
+    books = 'books'
+    snapshot = 'snapshot'
+    admin_email_name = 'admin_email'
+    changes_page_token = 'changes_page_token'
+    form_mime_type = 'application/vnd.google-apps.form'
+
+    cache_size = 512
+    #how many seconds old a cached value may be before it is read again, None means forever
+    max_ages = {book_club_sheet_id: None,
+                user_table: 10 * 60,
+                history: 60 * 60,
+                current_poll_id: 10 * 60,
+                poll_locations: 10 * 60,
+                books: 5 * 60}
+    #the book lists can fill the cache, but they shouldn't push these out
+    pinned_names = (book_club_sheet_id, user_table, history, current_poll_id, poll_locations)
 
     app_name = 'Book Club'
     should_print = True
     max_retries = 5
+    retry_deadline = 60
+    refused_statuses = (429,)
+    script_apis = ('appsscript', 'gmail')
     fetch_number = 10
+    fetch_growth = 4
+    worker_count = 4
+    bulk_worker_count = 4
+    book_list_chunk_size = 25
+    batch_size = 100
 
     title_sep = '\uff1a '
     author_sep = ', '
 
-    def __init__(self, credential_path, client_secret_path, credential_name, script_id):
+    def __init__(self, credential_path, client_secret_path, credential_name, script_id,
+                 rate_limits=None, disk_cache=None):
         super().__init__()
 
-        self.cache = Cache()
+        self.cache = Cache(max_size=self.cache_size, pinned=self.pinned_names)
+
+        if isinstance(disk_cache, DiskCache) or disk_cache is None:
+            self.disk_cache = disk_cache
+        else:
+            raise TypeError("Provided disk cache not a DiskCache object.")
+
+        self.page_token = None
+        self.changes_seen = 0
+        self.own_sheet_version = None
+
+        self.single_flight = SingleFlight()
+        self.identity_map = books_common.IdentityMap(books_common.BookLoader(self))
+        self.refresh_executor = ThreadPoolExecutor(max_workers=1)
+        #one long-lived pool, so its threads keep their services and connections between calls
+        self.executor = ThreadPoolExecutor(max_workers=self.worker_count)
+        #book list chunks can run for a long time, so they never hold up the menu reads above
+        self.bulk_executor = ThreadPoolExecutor(max_workers=self.bulk_worker_count)
+        self.refreshing = set()
+        self.served_stale = False
+
+        self.rate_limiter = RateLimiter(rate_limits)
+        self.script_limiter = ConcurrencyLimiter()
+
+        #calls that create or append something or send an email are only retried if they
+        #were refused, since doing them twice isn't harmless
+        self.default_retry_policy = RetryPolicy(self.max_retries, deadline=self.retry_deadline)
+        self.retry_policies = {}
+        for method_name in ('create_user', 'add_winner', 'new_poll', 'send_email'):
+            self.retry_policies[method_name] = RetryPolicy(
+                self.max_retries, deadline=self.retry_deadline,
+                transient_statuses=self.refused_statuses, refused_only=True)
 
         if isinstance(script_id, str):
             self.script_id = script_id
         else:
             raise TypeError("Provided script_id not a string.")
 
+        self.credential_name = credential_name
+        self.known_admin_email = None
+
         try:
-            # create service account api services
-            service_creds = ServiceAccountCredentials.from_json_keyfile_name(
+            # get the service account's credentials and email for sharing
+            service_creds = service_account.ServiceAccountCredentials.from_json_keyfile_name(
                 credential_path, self.service_scope)
-            drive_service = discovery.build('drive', 'v3',
-                                            http=service_creds.authorize(httplib2.Http()))
-            sheets_service = discovery.build('sheets', 'v4', credentials=service_creds)
-
-            # get the service account's email for sharing
             self.service_email = service_creds._service_account_email #Only way to get the email. pylint: disable=protected-access
         except FileNotFoundError:
             print('File: "' + str(credential_path) + '" was not found.')
             raise
 
         try:
-            # get the user's credentials and build the apps script service
+            # get the user's credentials for the apps script service
             appsscript_creds = get_credentials(
                 credential_name, client_secret_path, self.appsscript_scope, self.app_name)
-            appsscript_http = appsscript_creds.authorize(httplib2.Http())
-            appsscript_service = discovery.build('script', 'v1', http=appsscript_http)
-
-            # get the user's email for transferring ownership
-            email_function = {"function": "getEmail", "parameters": []}
-            email_request = appsscript_service.scripts().run( #The service objects are dynamically generated. pylint: disable=no-member
-                body=email_function, scriptId=self.script_id)
-            email_response = try_request_n_retries(email_request, self.max_retries)
-            self.admin_email = email_response['response'].get('result', str)
-
-            if self.admin_email == '':
-                raise AppsScriptError('Failed to retrieve user email.')
-
         except FileNotFoundError:
             print('File: "' + str(client_secret_path) + '" was not found.')
             raise
 
-        self.service = Services(drive_service, sheets_service, appsscript_service)
+        self.token_refresher = TokenRefresher(
+            appsscript_creds, os.path.join(get_credential_dir(), credential_name))
+        self.token_refresher.start()
+
+        #start building the api services at the same time
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            drive_future = executor.submit(discovery.build, 'drive', 'v3',
+                                           http=service_creds.authorize(httplib2.Http()))
+            sheets_future = executor.submit(discovery.build, 'sheets', 'v4',
+                                            http=service_creds.authorize(httplib2.Http()))
+            appsscript_future = executor.submit(discovery.build, 'script', 'v1',
+                                                http=appsscript_creds.authorize(httplib2.Http()))
+            drive_service = drive_future.result()
+            sheets_service = sheets_future.result()
+            appsscript_service = appsscript_future.result()
+        #end building the api services code
+
+        self.service = ThreadLocalServices(make_service_builder(drive_service, service_creds),
+                                           make_service_builder(sheets_service, service_creds),
+                                           make_service_builder(appsscript_service,
+                                                                appsscript_creds))
+        #this thread can keep the services that were just built
+        self.service.seed(drive_service, sheets_service, appsscript_service)
+
+    @property
+    def admin_email(self):
+        '''The email of the user running the apps script, used for transferring ownership.'''
+
+        return self.get_admin_email()
+
+    def get_admin_email(self):
+        '''Returns the email of the user running the apps script. It is only requested the
+        first time it is needed, and is remembered across runs with a disk cache.'''
+
+        if self.known_admin_email is not None:
+            return self.known_admin_email
+
+        if self.disk_cache is not None:
+            self.known_admin_email = self.disk_cache.get(self.admin_email_name,
+                                                         self.credential_name)
+            if self.known_admin_email is not None:
+                return self.known_admin_email
+
+        email_function = {"function": "getEmail", "parameters": []}
+        email_request = self.service.appsscript().scripts().run(
+            body=email_function, scriptId=self.script_id)
+        email_response = self.execute(email_request, 'get_admin_email')
+        admin_email = email_response['response'].get('result', '')
+
+        if admin_email == '':
+            raise AppsScriptError('Failed to retrieve user email.')
+
+        self.known_admin_email = admin_email
+        if self.disk_cache is not None:
+            self.disk_cache.set(self.admin_email_name, admin_email, self.credential_name)
+
+        return admin_email
+
+    def set_retry_policy(self, method_name, policy):
+        '''Sets the retry policy used for the requests made by the named method.'''
+
+        if isinstance(policy, RetryPolicy):
+            self.retry_policies[method_name] = policy
+        else:
+            raise TypeError("Provided policy not a RetryPolicy object.")
+
+    def execute(self, request, method_name):
+        '''Executes a request made by the named method, retrying it as its policy allows.
+        Every attempt waits for the rate limiter of the quota the request counts against.
+        Script executions also wait for a free slot in the script concurrency limiter.'''
+
+        policy = self.retry_policies.get(method_name, self.default_retry_policy)
+        api = get_request_api(request)
+        if api in self.script_apis:
+            request = LimitedRequest(request, self.script_limiter)
+
+        return policy.execute(request, lambda: self.rate_limiter.acquire(api))
 
     def get_file_list(self):
         '''Returns a list of files accessible by the service account.'''
 
         files_request = self.service.drive().files().list(fields="nextPageToken, files(id, name)")
-        files_results = try_request_n_retries(files_request, self.max_retries)
+        files_results = self.execute(files_request, 'get_file_list')
         files = files_results.get('files', [])
         next_page_token = files_results.get('nextPageToken')
 
@@ -257,77 +1001,214 @@ class GoogleDocsBot(books_common.DataIO):
             #make sure to get the full list if required
             files_request = self.service.drive().files().list(
                 pageToken=next_page_token, fields="nextPageToken, files(id, name)")
-            files_results = try_request_n_retries(files_request, self.max_retries)
+            files_results = self.execute(files_request, 'get_file_list')
             files += files_results.get('files', [])
             next_page_token = files_results.get('nextPageToken')
 
         return files
 
-    def get_book_club_info_sheet_id(self):
-        '''Returns the file id of the sheet used to store book club information.'''
+    def find_book_club_info_sheet(self):
+        '''Searches Drive for the sheet used to store book club information.
+        Returns its file id, or None if it does not exist.'''
+
+        query = "name = '" + self.info_spread_names[0] + "' and mimeType = '"
+        query += self.spreadsheet_mime_type + "' and trashed = false"
+        files_request = self.service.drive().files().list(
+            q=query, pageSize=1, fields="files(id, name)")
+        files_results = self.execute(files_request, 'find_book_club_info_sheet')
+        files = files_results.get('files', [])
 
-        if not self.cache.is_fresh(self.book_club_sheet_id):
-            files = self.get_file_list()
+        if files:
+            return files[0]['id']
 
-            if files:
-                for item in files:
-                    if item['name'] == self.info_spread_names[0]:
-                        self.cache.set_value(self.book_club_sheet_id, item['id'])
-                        break
+        return None
+
+    def get_sheet_id_path(self):
+        '''Returns the path of the file that remembers the book club sheet id between runs.'''
+
+        return os.path.join(get_credential_dir(), self.service_email + self.sheet_id_extension)
+
+    def save_book_club_info_sheet_id(self, sheet_id):
+        '''Remembers the book club sheet id for this and later runs.'''
+
+        self.cache.set_value(self.book_club_sheet_id, sheet_id)
+
+        try:
+            with open(self.get_sheet_id_path(), 'w') as id_file:
+                id_file.write(sheet_id)
+        except IOError:
+            if self.should_print:
+                print('Unable to save the book club sheet id')
+
+    def forget_book_club_info_sheet_id(self):
+        '''Discards the remembered book club sheet id, so it will be looked up again.'''
+
+        self.cache.timeout_var(self.book_club_sheet_id)
+
+        try:
+            os.remove(self.get_sheet_id_path())
+        except OSError:
+            pass
 
-            if not self.cache.is_fresh(self.book_club_sheet_id):
+    def get_book_club_info_sheet_id(self):
+        '''Returns the file id of the sheet used to store book club information.'''
+
+        max_age = self.max_ages[self.book_club_sheet_id]
+        if not self.cache.is_fresh(self.book_club_sheet_id, max_age):
+            #start trying the id saved by an earlier run
+            try:
+                with open(self.get_sheet_id_path()) as id_file:
+                    saved_id = id_file.read().strip()
+            except IOError:
+                saved_id = ''
+
+            if saved_id != '':
+                self.cache.set_value(self.book_club_sheet_id, saved_id)
+                return saved_id
+            #end trying the id saved by an earlier run code
+
+            sheet_id = self.find_book_club_info_sheet()
+            if sheet_id is None:
                 raise SpreadsheetFormatError('No User spreadsheet found.')
 
+            self.save_book_club_info_sheet_id(sheet_id)
+
         return self.cache.get_value(self.book_club_sheet_id)
 
-    def get_user_table(self):
-        '''Returns a matrix of user records.'''
+    def read_book_club_info(self, read_function):
+        '''Calls read_function with the book club sheet id and returns the result.
+        If the sheet is not found, the id is looked up again and the read is retried once.'''
+
+        user_sheet_id = self.get_book_club_info_sheet_id()
+        try:
+            return read_function(user_sheet_id)
+        except errors.HttpError as error:
+            if error.resp.status != 404:
+                raise
+
+            self.forget_book_club_info_sheet_id()
+            if self.get_book_club_info_sheet_id() == user_sheet_id:
+                raise
+
+        return read_function(self.get_book_club_info_sheet_id())
+
+    def get_sheet_row_counts(self):
+        '''Returns a dictionary of sheet names to the number of rows in each sheet.'''
 
-        if not self.cache.is_fresh(self.user_table):
-            user_sheet_id = self.get_book_club_info_sheet_id()
+        def read_row_counts(user_sheet_id):
+            '''Requests the properties of every sheet.'''
+            info_request = self.service.sheets().spreadsheets().get(
+                spreadsheetId=user_sheet_id,
+                fields='sheets(properties(title,gridProperties(rowCount)))')
+            return self.execute(info_request, 'get_sheet_row_counts')
 
-            range_start = 1
-            user_info = {}
+        info_result = self.read_book_club_info(read_row_counts)
 
-            range_string = get_a1_notation(self.info_spread_names[1], 1, range_start,
-                                           self.user_sheet_width,
-                                           (range_start + self.fetch_number - 1))
-            users_request = self.service.sheets().spreadsheets().values().get(
+        row_counts = {}
+        for sheet in info_result.get('sheets', []):
+            properties = sheet.get('properties', {})
+            row_counts[properties.get('title')] = properties.get('gridProperties', {}).get(
+                'rowCount', 0)
+
+        return row_counts
+
+    def read_rows(self, sheet_name, width):
+        '''Yields the non-empty rows of a sheet, reading it in growing windows.
+        The next window is requested while the current one is being parsed.'''
+
+        row_count = self.get_sheet_row_counts().get(sheet_name, 0)
+        user_sheet_id = self.get_book_club_info_sheet_id()
+        windows = get_row_windows(row_count, self.fetch_number, self.fetch_growth)
+
+        def fetch_window(window):
+            '''Requests the rows in one window.'''
+            range_string = get_a1_notation(sheet_name, 1, window[0], width, window[1])
+            request = self.service.sheets().spreadsheets().values().get(
                 majorDimension='ROWS', spreadsheetId=user_sheet_id, range=range_string)
-            users_result = try_request_n_retries(users_request, self.max_retries)
-            values = users_result.get('values', [])
+            return self.execute(request, 'read_rows').get('values', [])
+
+        if not windows:
+            return
+
+        pending = self.executor.submit(fetch_window, windows[0])
+        for i in range(len(windows)):
+            values = pending.result()
+
+            #the sheet has no more data, stop early
+            if values == []:
+                break
+
+            #start fetching the next window before parsing this one
+            if i + 1 < len(windows):
+                pending = self.executor.submit(fetch_window, windows[i + 1])
+
+            for row in values:
+                if row != []:
+                    yield row
+
+    def revalidate(self, key, function, *args):
+        '''Runs function in the background to refresh a stale cached value.
+        Only one refresh per key runs at a time. Marks that stale data was served.'''
 
-            while values != []:
-                for user in values:
-                    if user != []:
-                        user_info[user[0]] = user
+        with self.cache.lock:
+            self.served_stale = True
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
 
-                range_start += self.fetch_number
-                range_string = get_a1_notation(self.info_spread_names[1],
-                                               1, range_start,
-                                               self.user_sheet_width,
-                                               (range_start + self.fetch_number - 1))
+        def refresh():
+            try:
+                function(*args)
+            except (errors.HttpError, AppsScriptError, SpreadsheetFormatError):
+                pass #the stale value is kept, and the next read tries again
+            finally:
+                with self.cache.lock:
+                    self.refreshing.discard(key)
 
-                users_request = self.service.sheets().spreadsheets().values().get(
-                    majorDimension='ROWS', spreadsheetId=user_sheet_id, range=range_string)
-                users_result = try_request_n_retries(users_request, self.max_retries)
-                values = users_result.get('values', [])
+        self.refresh_executor.submit(refresh)
 
-            self.cache.set_value(self.user_table, user_info)
+    def pop_stale_flag(self):
+        '''Returns whether stale data was served since the last call, and clears the flag.'''
+
+        with self.cache.lock:
+            served_stale = self.served_stale
+            self.served_stale = False
+
+        return served_stale
+
+    def get_user_table(self, allow_stale=False):
+        '''Returns a matrix of user records.
+        If allow_stale is set, an old table is returned at once while a new one is read.'''
+
+        if not self.cache.is_fresh(self.user_table, self.max_ages[self.user_table]):
+            stale_table = self.cache.get_stale(self.user_table) if allow_stale else None
+            if stale_table is not None:
+                self.revalidate(self.user_table, self.get_user_table)
+                return stale_table
+
+            return self.single_flight.do(self.user_table, self.fetch_user_table)
 
         return self.cache.get_value(self.user_table)
 
+    def fetch_user_table(self):
+        '''Reads the user records into the cache and returns them.'''
+
+        user_info = {}
+        for user in self.read_rows(self.info_spread_names[1], self.user_sheet_width):
+            user_info[user[0]] = user
+
+        self.cache.set_value(self.user_table, user_info)
+
+        return user_info
+
     def make_new_book_club(self):
         '''Creates the document structure for a new book club. Returns success.'''
 
         #start checking for old book club
-        files = self.get_file_list()
-        if files:
-            for item in files:
-                if item['name'] == self.info_spread_names[0]:
-                    if self.should_print:
-                        print('Book Club already exists under this bot.')
-                    return False #Can't make a new book club when there is already one
+        if self.find_book_club_info_sheet() is not None:
+            if self.should_print:
+                print('Book Club already exists under this bot.')
+            return False #Can't make a new book club when there is already one
         #end checking for old book club code
 
         #start creating new book club
@@ -347,7 +1228,7 @@ class GoogleDocsBot(books_common.DataIO):
         new_sheet_request = self.service.sheets().spreadsheets().create(body=spreadsheet_body)
         try:
             #make the new spreadsheet
-            new_sheet_response = try_request_n_retries(new_sheet_request, self.max_retries)
+            new_sheet_response = self.execute(new_sheet_request, 'make_new_book_club')
         except errors.HttpError:
             if self.should_print:
                 print('Failed to create the new User spreadsheet')
@@ -368,43 +1249,45 @@ class GoogleDocsBot(books_common.DataIO):
             transferOwnership=True) #only required for 'owner' permission
 
         #share the new spreadsheet
-        share_response = try_request_n_retries(share_request, self.max_retries)
+        share_response = self.execute(share_request, 'make_new_book_club')
         #end sharing code
 
-        self.cache.set_value(self.book_club_sheet_id, new_sheet_file_id)
+        self.save_book_club_info_sheet_id(new_sheet_file_id)
 
         return not 'error' in share_response
 
-    def get_user_names(self):
-        '''Returns a list of usernames.'''
+    def get_user_names(self, allow_stale=False):
+        '''Returns a list of usernames. If allow_stale is set, an old list may be returned.'''
 
-        user_table = self.get_user_table()
+        user_table = self.get_user_table(allow_stale)
 
         user_names = list(user_table.keys())
 
         return user_names
 
-    def get_user_info(self, username):
-        '''Returns a user's information.'''
+    def get_user_info(self, username, allow_stale=False):
+        '''Returns a user's information. The same User object is returned for a username
+        each time, with its details updated. If allow_stale is set, old details may be used.'''
 
         user_info = []
-        user_table = self.get_user_table()
+        user_table = self.get_user_table(allow_stale)
 
         if username in user_table:
             user_info = user_table[username]
 
         if len(user_info) >= self.user_sheet_width:
-            return books_common.User(user_info[0], user_info[1], [], user_info[2], self)
+            return self.identity_map.get_user(user_info[0], user_info[1], user_info[2], self)
 
         return user_info
 
-    def get_user_books(self, user):
-        '''Returns the list of books entered by the user and updates the user object's book list.'''
+    def get_user_books(self, user, allow_stale=False):
+        '''Returns the list of books entered by the user and updates the user object's book list.
+        If allow_stale is set, an old list may be returned.'''
 
         #start finding user
         username = user.get_user_name()
         get_form_id = None
-        user_table = self.get_user_table()
+        user_table = self.get_user_table(allow_stale)
 
         if username in user_table:
             get_form_id = user_table[username][3]
@@ -412,70 +1295,460 @@ class GoogleDocsBot(books_common.DataIO):
             raise SpreadsheetFormatError('Requested User does not exist.')
         #end finding user code
 
-        #start getting raw books
-        getbooks_function = {"function": "getBookList", "parameters": [get_form_id]}
+        rawbooks_list = self.get_raw_book_lists([get_form_id], allow_stale)[get_form_id]
+        books_list = self.make_books(get_form_id, rawbooks_list)
+
+        #replace the old books with the new ones
+        self.set_user_books(user, books_list)
+
+        return books_list
+
+    def books_name(self, form_id):
+        '''Returns the name the responses of a book form are cached under.'''
+
+        return self.books + '/' + form_id
+
+    def get_file_versions(self, file_ids):
+        '''Returns a dictionary of file ids to their Drive version numbers, looking up only
+        those files, batch_size at a time. Files that could not be read map to None.'''
+
+        versions = {file_id: None for file_id in file_ids}
+
+        def record_version(request_id, response, exception): # pylint: disable=unused-argument
+            '''Records the version of one file in a batch.'''
+            if exception is None:
+                versions[response['id']] = response.get('version')
+
+        for i in range(0, len(file_ids), self.batch_size):
+            chunk = file_ids[i:i + self.batch_size]
+            batch = self.service.drive().new_batch_http_request(callback=record_version)
+            for file_id in chunk:
+                batch.add(self.service.drive().files().get(fileId=file_id, fields='id, version'))
+
+            #every request in a batch counts against the quota, execute waits for one of them
+            for _ in range(len(chunk) - 1):
+                self.rate_limiter.acquire('drive')
+            self.execute(batch, 'get_file_versions')
+
+        return versions
+
+    def get_raw_book_lists(self, form_ids, allow_stale=False):
+        '''Returns a dictionary of form ids to the raw responses of each book form.
+        Fresh cached responses are reused and the rest are fetched in one execution.
+        If allow_stale is set, old responses are returned and refreshed in the background.
+        Forms that could not be read are left out.'''
+
+        raw_lists = {}
+        missing_ids = []
+        stale_ids = []
+        for form_id in set(form_ids):
+            stale_list = None
+            if self.cache.is_fresh(self.books_name(form_id), self.max_ages[self.books]):
+                raw_lists[form_id] = self.cache.get_value(self.books_name(form_id))
+            elif allow_stale:
+                stale_list = self.cache.get_stale(self.books_name(form_id))
+
+            if stale_list is not None:
+                raw_lists[form_id] = stale_list
+                stale_ids.append(form_id)
+            elif form_id not in raw_lists:
+                missing_ids.append(form_id)
+
+        if stale_ids:
+            stale_ids.sort()
+            self.revalidate((self.books,) + tuple(stale_ids), self.get_raw_book_lists, stale_ids)
+
+        if missing_ids:
+            missing_ids.sort()
+            raw_lists.update(self.single_flight.do((self.books,) + tuple(missing_ids),
+                                                   self.fetch_book_lists, missing_ids))
+
+        return raw_lists
+
+    def fetch_book_lists(self, missing_ids):
+        '''Reads the raw responses of the given book forms into the cache and returns them.'''
+
+        raw_lists = {}
+        changes_seen = self.changes_seen
+
+        #start getting raw books, in chunks small enough to finish within the script time limit
+        chunk_size = self.book_list_chunk_size
+        chunks = [missing_ids[i:i + chunk_size] for i in range(0, len(missing_ids), chunk_size)]
+
+        if len(chunks) == 1:
+            fetched_lists = self.read_book_list_chunk(chunks[0])
+        else:
+            pending = [self.bulk_executor.submit(self.read_book_list_chunk, chunk)
+                       for chunk in chunks]
+            fetched_lists = {}
+            first_error = None
+            for future in pending:
+                try:
+                    fetched_lists.update(future.result())
+                except (errors.HttpError, AppsScriptError) as error:
+                    first_error = first_error or error
+
+            #forms in a failed chunk are left out, unless every chunk failed
+            if not fetched_lists and first_error is not None:
+                raise first_error
+        #end getting raw books code
+
+        for form_id, rawbooks_list in fetched_lists.items():
+            if rawbooks_list is not None:
+                self.cache.set_value(self.books_name(form_id), rawbooks_list)
+                raw_lists[form_id] = rawbooks_list
+
+        #the changes feed removes saved lists that change, so they are only saved if no
+        #change was reported while they were read, otherwise an old list could outlive its removal
+        if self.disk_cache is not None and changes_seen == self.changes_seen:
+            for form_id, rawbooks_list in raw_lists.items():
+                self.disk_cache.set(self.books_name(form_id), rawbooks_list, self.service_email)
+
+        return raw_lists
+
+    def read_book_list_chunk(self, form_ids):
+        '''Returns a dictionary of form ids to raw responses, read in one script execution.
+        Forms that could not be read map to None.'''
+
+        if len(form_ids) == 1:
+            getbooks_function = {"function": "getBookList", "parameters": [form_ids[0]]}
+            getbooks_request = self.service.appsscript().scripts().run(
+                body=getbooks_function, scriptId=self.script_id)
+            getbooks_response = self.execute(getbooks_request, 'get_user_books')
+            return {form_ids[0]: getbooks_response['response'].get('result', [])}
+
+        getbooks_function = {"function": "getBookLists", "parameters": [form_ids]}
         getbooks_request = self.service.appsscript().scripts().run(
             body=getbooks_function, scriptId=self.script_id)
-        getbooks_response = try_request_n_retries(getbooks_request, self.max_retries)
-        rawbooks_list = getbooks_response['response'].get('result', [])
-        #end getting raw books code
+        getbooks_response = self.execute(getbooks_request, 'get_books_for_users')
+        return getbooks_response['response'].get('result', {})
 
-        #start assembling book list
-        books_list = [books_common.Book(i['title'], i['authorFirstName'], i['authorLastName'],
-                                        FormLocation(get_form_id, i['formResponseId']), self)
-                      for i in rawbooks_list]
-        #end assembling book list code
+    def forget_books(self, form_id):
+        '''Discards the cached responses of a book form after it is changed.'''
 
-        #replace the old books with the new ones
+        self.cache.forget(self.books_name(form_id))
+        if self.disk_cache is not None:
+            self.disk_cache.delete(self.books_name(form_id))
+
+    def load_saved_book_lists(self):
+        '''Fills the cache with the book lists saved by an earlier run.
+        refresh_changes should be called first, since it removes the lists that have changed.'''
+
+        if self.disk_cache is None:
+            return
+
+        form_ids = [user[3] for user in self.get_user_table().values()
+                    if len(user) >= self.user_sheet_width]
+        if not form_ids:
+            return
+
+        for form_id in form_ids:
+            rawbooks_list = self.disk_cache.get(self.books_name(form_id), self.service_email)
+            if rawbooks_list is not None:
+                self.cache.set_value(self.books_name(form_id), rawbooks_list)
+
+    def get_changes_page_token(self):
+        '''Returns the Drive changes page token saved by this or an earlier run, or None.'''
+
+        if self.page_token is None and self.disk_cache is not None:
+            self.page_token = self.disk_cache.get(self.changes_page_token, self.service_email)
+
+        return self.page_token
+
+    def set_changes_page_token(self, page_token):
+        '''Remembers where in the Drive changes feed the next refresh starts.'''
+
+        self.page_token = page_token
+        if self.disk_cache is not None:
+            self.disk_cache.set(self.changes_page_token, page_token, self.service_email)
+
+    def refresh_changes(self):
+        '''Discards the cached values of every file changed since the last refresh.
+        The first refresh only starts tracking changes. Returns the set of changed file ids.'''
+
+        page_token = self.get_changes_page_token()
+
+        if page_token is None:
+            token_request = self.service.drive().changes().getStartPageToken()
+            token_result = self.execute(token_request, 'refresh_changes')
+            self.set_changes_page_token(token_result['startPageToken'])
+            return set()
+
+        #start reading every change since the last refresh
+        user_sheet_id = self.cache.get_value(self.book_club_sheet_id)
+        changed_ids = set()
+        while page_token is not None:
+            changes_request = self.service.drive().changes().list(
+                pageToken=page_token, pageSize=1000, spaces='drive',
+                fields='nextPageToken, newStartPageToken, changes(fileId, file(version))')
+            changes_result = self.execute(changes_request, 'refresh_changes')
+
+            for change in changes_result.get('changes', []):
+                #the bot's own writes to the sheet are already in the cache
+                version = change.get('file', {}).get('version')
+                if (change['fileId'] == user_sheet_id and version is not None and
+                        self.own_sheet_version is not None and
+                        int(version) <= self.own_sheet_version):
+                    continue
+
+                changed_ids.add(change['fileId'])
+
+            if 'newStartPageToken' in changes_result:
+                self.set_changes_page_token(changes_result['newStartPageToken'])
+            page_token = changes_result.get('nextPageToken')
+        #end reading every change code
+
+        #start discarding the cached values of changed files
+        if user_sheet_id in changed_ids:
+            for name in (self.user_table, self.history, self.current_poll_id,
+                         self.poll_locations):
+                self.cache.timeout_var(name)
+
+            if self.disk_cache is not None:
+                self.disk_cache.delete(self.snapshot)
+
+        if changed_ids:
+            self.changes_seen += 1
+
+        for form_id in changed_ids:
+            self.forget_books(form_id)
+        #end discarding the cached values of changed files code
+
+        return changed_ids
+
+    def make_books(self, form_id, rawbooks_list):
+        '''Assembles book objects from the raw responses of a book form.
+        A response that was read before gives back the same Book object.'''
+
+        return [self.identity_map.get_book(
+            (form_id, i['formResponseId']), i['title'], i['authorFirstName'],
+            i['authorLastName'], functools.partial(FormLocation, form_id, i['formResponseId']),
+            self) for i in rawbooks_list]
+
+    def set_user_books(self, user, books_list):
+        '''Replaces a user's books, forgetting the books that are no longer on the list.'''
+
+        self.identity_map.forget_books([book for book in user.books
+                                        if not any(book is new_book for new_book in books_list)])
         user.replace_books(books_list)
 
-        return books_list
+    def get_books_for_users(self, users):
+        '''Fetches the books of many users in one script execution.
+        Returns a dictionary of user names to book lists, leaving out users whose
+        books could not be retrieved, and updates each user object's books.'''
+
+        #start finding forms
+        user_table = self.get_user_table()
+        form_ids = {}
+        for user in users:
+            username = user.get_user_name()
+            if username in user_table:
+                form_ids[username] = user_table[username][3]
+        #end finding forms code
+
+        if not form_ids:
+            return {}
+
+        rawbooks_lists = self.get_raw_book_lists(list(form_ids.values()))
+
+        books = {}
+        for user in users:
+            username = user.get_user_name()
+            rawbooks_list = rawbooks_lists.get(form_ids.get(username))
+            if rawbooks_list is not None:
+                books[username] = self.make_books(form_ids[username], rawbooks_list)
+                self.set_user_books(user, books[username])
+
+        return books
 
     def get_history(self):
         '''Gets a list of books that have previously won a contest.'''
 
-        if not self.cache.is_fresh(self.history):
-            user_sheet_id = self.get_book_club_info_sheet_id()
+        if not self.cache.is_fresh(self.history, self.max_ages[self.history]):
+            return self.single_flight.do(self.history, self.fetch_history)
+
+        return self.cache.get_value(self.history)
+
+    def fetch_history(self):
+        '''Reads the history into the cache and returns it.'''
+
+        history = list(self.read_rows(self.info_spread_names[2], self.history_sheet_width))
+
+        self.cache.set_value(self.history, history)
+
+        return history
+
+    def load_snapshot(self):
+        '''Reads the users, history and current poll location data in a single request.
+        Replaces the cached values so they all come from the same point in time.
+        With a disk cache, the saved copy is used instead if the sheet has not changed.'''
+
+        #start trying the copy saved by an earlier run
+        sheet_version = None
+        if self.disk_cache is not None:
+            sheet_version = self.read_book_club_info(
+                lambda user_sheet_id: self.get_file_versions([user_sheet_id])[user_sheet_id])
+            saved_snapshot = self.disk_cache.get(self.snapshot, sheet_version)
+            if saved_snapshot is not None:
+                self.set_snapshot(*saved_snapshot)
+                return
+        #end trying the copy saved by an earlier run code
+
+        ranges = [get_columns_a1_notation(self.info_spread_names[1], 1, self.user_sheet_width),
+                  get_columns_a1_notation(self.info_spread_names[2], 1, self.history_sheet_width),
+                  get_columns_a1_notation(self.info_spread_names[3], 1, self.location_width)]
+
+        def read_snapshot(user_sheet_id):
+            '''Requests every range at once.'''
+            snapshot_request = self.service.sheets().spreadsheets().values().batchGet(
+                majorDimension='ROWS', spreadsheetId=user_sheet_id, ranges=ranges)
+            return self.execute(snapshot_request, 'load_snapshot')
 
-            range_start = 1
-            history = []
+        snapshot_result = self.read_book_club_info(read_snapshot)
 
-            range_string = get_a1_notation(self.info_spread_names[2],
-                                           1, range_start,
-                                           self.history_sheet_width,
-                                           (range_start + self.fetch_number - 1))
-            history_request = self.service.sheets().spreadsheets().values().get(
+        value_ranges = snapshot_result.get('valueRanges', [])
+        if len(value_ranges) != len(ranges):
+            raise SpreadsheetFormatError('Book club information is missing a sheet.')
+
+        user_values, history_values, global_values = [i.get('values', []) for i in value_ranges]
+
+        self.set_snapshot(user_values, history_values, global_values)
+
+        if self.disk_cache is not None:
+            self.disk_cache.set(self.snapshot, [user_values, history_values, global_values],
+                                sheet_version)
+
+    def set_snapshot(self, user_values, history_values, global_values):
+        '''Fills the cache from the rows of the Users, History and GlobalInfo sheets.'''
+
+        #start parsing users and history
+        user_info = {}
+        for user in user_values:
+            if user != []:
+                user_info[user[0]] = user
+
+        history = [book for book in history_values if book != []]
+        #end parsing users and history code
+
+        current_poll_id, location_dict = self.parse_global_info(global_values)
+
+        self.cache.set_value(self.user_table, user_info)
+        self.cache.set_value(self.history, history)
+        self.cache.set_value(self.current_poll_id, current_poll_id)
+        self.cache.set_value(self.poll_locations, location_dict)
+
+    def parse_global_info(self, values):
+        '''Splits the rows of the GlobalInfo sheet into the poll id and the location table.'''
+
+        current_poll_id = ''
+        if values and values[0] and values[0][0]:
+            current_poll_id = values[0][0].strip()
+
+        location_dict = {}
+        if current_poll_id != '':
+            for row in values[1:]:
+                #rows left over from a longer, older poll come after the current ones
+                if len(row) >= self.location_width and not row[0] in location_dict:
+                    location_dict[row[0]] = FormLocation(row[1], row[2])
+
+        return current_poll_id, location_dict
+
+    def read_global_info(self):
+        '''Reads the poll id and the location table and caches both.'''
+
+        range_string = get_columns_a1_notation(self.info_spread_names[3], 1, self.location_width)
+
+        def read_poll_info(user_sheet_id):
+            '''Requests the poll id and every location row.'''
+            request = self.service.sheets().spreadsheets().values().get(
                 majorDimension='ROWS', spreadsheetId=user_sheet_id, range=range_string)
-            history_result = try_request_n_retries(history_request, self.max_retries)
-            values = history_result.get('values', [])
+            return self.execute(request, 'read_global_info')
 
-            while values != []:
-                for book in values:
-                    if book != []:
-                        history.append(book)
+        values = self.read_book_club_info(read_poll_info).get('values', [])
+        current_poll_id, location_dict = self.parse_global_info(values)
 
-                range_start += self.fetch_number
-                range_string = get_a1_notation(self.info_spread_names[2],
-                                               1, range_start,
-                                               self.history_sheet_width,
-                                               (range_start + self.fetch_number - 1))
+        self.cache.set_value(self.current_poll_id, current_poll_id)
+        self.cache.set_value(self.poll_locations, location_dict)
 
-                history_request = self.service.sheets().spreadsheets().values().get(
-                    majorDimension='ROWS', spreadsheetId=user_sheet_id, range=range_string)
-                history_result = try_request_n_retries(history_request, self.max_retries)
-                values = history_result.get('values', [])
+    def get_current_poll_id(self):
+        '''Returns the id of the currently ongoing poll, or an empty string if there is none.'''
 
-            self.cache.set_value(self.history, history)
+        if not self.cache.is_fresh(self.current_poll_id, self.max_ages[self.current_poll_id]):
+            self.read_global_info()
 
-        return self.cache.get_value(self.history)
+        return self.cache.get_value(self.current_poll_id)
+
+    def get_poll_locations(self):
+        '''Returns a dictionary of poll option identifiers to the locations of the books.'''
+
+        if not self.cache.is_fresh(self.poll_locations, self.max_ages[self.poll_locations]):
+            self.read_global_info()
+
+        return self.cache.get_value(self.poll_locations)
+
+    def append_row(self, sheet_name, width, record, method_name):
+        '''Adds a row after the last row of a sheet, without reading the sheet first.
+        Returns the row as it was stored, or None if the append reported an error.'''
+
+        range_string = get_a1_notation(sheet_name, 1, 1, width, 1)
+        append_body = {
+            "range": range_string,
+            "majorDimension": "ROWS",
+            "values": [record],
+        }
+        append_request = self.service.sheets().spreadsheets().values().append(
+            spreadsheetId=self.get_book_club_info_sheet_id(), range=range_string,
+            valueInputOption='RAW', insertDataOption='INSERT_ROWS',
+            includeValuesInResponse=True, body=append_body)
+
+        append_response = self.execute(append_request, method_name)
+        if 'error' in append_response:
+            return None
+
+        stored_values = append_response.get('updates', {}).get('updatedData', {}).get('values')
+        if stored_values:
+            return stored_values[0]
+        return record
+
+    def record_own_write(self):
+        '''Remembers the version of the book club sheet after the bot wrote to it, so that
+        refresh_changes doesn't discard the values the bot cached along with the write.'''
+
+        user_sheet_id = self.get_book_club_info_sheet_id()
+        try:
+            version = self.get_file_versions([user_sheet_id])[user_sheet_id]
+        except (errors.HttpError, httplib2.HttpLib2Error):
+            return
+
+        if version is not None:
+            self.own_sheet_version = max(int(version), self.own_sheet_version or 0)
+
+    def update_cached_value(self, name, max_age, update_function):
+        '''Replaces a cached value with update_function(value), if there is one. The new
+        value is a copy, so readers in other threads never see a change, and it is only
+        fresh if the old value was.'''
+
+        with self.cache.lock:
+            old_value = self.cache.get_stale(name)
+            if old_value is None:
+                return
+
+            fresh = self.cache.is_fresh(name, max_age)
+            self.cache.set_value(name, update_function(old_value))
+            if not fresh:
+                self.cache.timeout_var(name)
 
     def create_user(self, username, user_email):
-        '''Creates all the data entries for a new user.'''
+        '''Creates all the data entries for a new user.
+        A stale cached user table is good enough to check for an existing user with the same
+        name, but the table is fetched if nothing is cached.'''
 
         #start check if user exists
-        existing_user_names = self.get_user_names()
+        existing_user_table = self.cache.get_stale(self.user_table)
+        if existing_user_table is None:
+            existing_user_table = self.get_user_table()
 
-        if username in existing_user_names:
+        if username in existing_user_table:
             if self.should_print:
                 print('User already exists.')
             return False
@@ -486,7 +1759,7 @@ class GoogleDocsBot(books_common.DataIO):
                              "parameters": [self.service_email, username]}
         userform_request = self.service.appsscript().scripts().run(
             body=userform_function, scriptId=self.script_id)
-        userform_response = try_request_n_retries(userform_request, self.max_retries)
+        userform_response = self.execute(userform_request, 'create_user')
 
         userform_dict = userform_response['response'].get('result', {})
         #end make the book input form code
@@ -494,30 +1767,16 @@ class GoogleDocsBot(books_common.DataIO):
         #assemble user record
         user_record = [username, user_email, userform_dict['form_url'], userform_dict['form_id']]
 
-        #start insert of user record
-        range_string = get_a1_notation(self.info_spread_names[1],
-                                       1, len(existing_user_names) + 1,
-                                       self.user_sheet_width, len(existing_user_names) + 1)
-
-        update_body = {
-            "range": range_string,
-            "majorDimension": "ROWS",
-            "values": [user_record],
-        }
-        update_request = self.service.sheets().spreadsheets().values().update(
-            spreadsheetId=self.get_book_club_info_sheet_id(), range=range_string,
-            valueInputOption='RAW', body=update_body)
-
-        update_response = try_request_n_retries(update_request, self.max_retries)
-        #end insert of user record code
+        #insert user record after the last one
+        user_record = self.append_row(self.info_spread_names[1], self.user_sheet_width,
+                                      user_record, 'create_user')
 
-        #start updating cache
-        temp_user_table = self.get_user_table()
-        temp_user_table[username] = user_record
-        self.cache.set_value(self.user_table, temp_user_table)
-        #end updating cache code
+        if user_record is not None:
+            self.update_cached_value(self.user_table, self.max_ages[self.user_table],
+                                     lambda user_table: {**user_table, username: user_record})
+            self.record_own_write()
 
-        return books_common.User(username, user_email, [], userform_dict['form_url'], self)
+        return self.identity_map.get_user(username, user_email, userform_dict['form_url'], self)
 
     def remove_book(self, book):
         '''Deletes a book from a user's remote list.'''
@@ -532,7 +1791,9 @@ class GoogleDocsBot(books_common.DataIO):
         delbook_function = {"function": "delResponse", "parameters": [form_id, response_id]}
         delbook_request = self.service.appsscript().scripts().run(
             body=delbook_function, scriptId=self.script_id)
-        delbook_response = try_request_n_retries(delbook_request, self.max_retries)
+        delbook_response = self.execute(delbook_request, 'remove_book')
+        self.forget_books(form_id)
+        self.identity_map.forget_books([book])
 
         return not 'error' in delbook_response
 
@@ -553,88 +1814,62 @@ class GoogleDocsBot(books_common.DataIO):
         delbooks_function = {"function": "delAllResponses", "parameters": [form_id]}
         delbooks_request = self.service.appsscript().scripts().run(
             body=delbooks_function, scriptId=self.script_id)
-        delbooks_response = try_request_n_retries(delbooks_request, self.max_retries)
+        delbooks_response = self.execute(delbooks_request, 'remove_all_books')
+        self.forget_books(form_id)
 
-        user.replace_books([])
+        self.set_user_books(user, [])
 
         return not 'error' in delbooks_response
 
     def add_winner(self, book):
         '''Adds a winner to the history file.'''
 
-        history = self.get_history()
         date = time.strftime('%Y/%m/%d')
 
         winner_record = [date, book.get_title(), book.get_author_first_name(),
                          book.get_author_last_name()]
 
-        new_record_number = len(history) + 1
-        range_string = get_a1_notation(self.info_spread_names[2],
-                                       1, new_record_number,
-                                       self.history_sheet_width, new_record_number)
-        user_sheet_id = self.get_book_club_info_sheet_id()
-        update_body = {
-            "range": range_string,
-            "majorDimension": "ROWS",
-            "values": [winner_record],
-        }
-        update_request = self.service.sheets().spreadsheets().values().update(
-            spreadsheetId=user_sheet_id, range=range_string,
-            valueInputOption='RAW', body=update_body)
-
-        update_response = try_request_n_retries(update_request, self.max_retries)
+        winner_record = self.append_row(self.info_spread_names[2], self.history_sheet_width,
+                                        winner_record, 'add_winner')
+        if winner_record is None:
+            return False
 
-        history.append(winner_record)
-        self.cache.set_value(self.history, history)
+        self.update_cached_value(self.history, self.max_ages[self.history],
+                                 lambda history: history + [winner_record])
+        self.record_own_write()
 
-        return not 'error' in update_response
+        return True
 
     def get_current_poll(self):
         '''Returns the currently ongoing book poll.'''
 
         #start obtaining the current poll id
-        user_sheet_id = self.get_book_club_info_sheet_id()
+        current_poll_id = self.get_current_poll_id()
 
-        range_string = get_a1_notation(self.info_spread_names[3],
-                                       self.poll_id_position[0], self.poll_id_position[1],
-                                       self.poll_id_position[0], self.poll_id_position[1])
-        request = self.service.sheets().spreadsheets().values().get(
-            majorDimension='ROWS', spreadsheetId=user_sheet_id, range=range_string)
-        result = try_request_n_retries(request, self.max_retries)
-        values = result.get('values', [])
-
-        current_poll_id = ''
-        if values and values[0] and values[0][0]:
-            current_poll_id = values[0][0]
-
-        if current_poll_id.strip() == '':
+        if current_poll_id == '':
             return None
         #end obtaining the current poll id code
 
-        #start getting the poll/response data
+        #start getting the poll/response data and the response location data together
+        #reading the poll id nearly always caches the locations, so only a miss is read alongside
+        location_dict = None
+        pending_locations = None
+        if self.cache.is_fresh(self.poll_locations, self.max_ages[self.poll_locations]):
+            location_dict = self.cache.get_value(self.poll_locations)
+        if location_dict is None:
+            pending_locations = self.executor.submit(self.get_poll_locations)
+
         getpoll_function = {"function": "getPollInfo", "parameters": [current_poll_id]}
         request = self.service.appsscript().scripts().run(
             body=getpoll_function, scriptId=self.script_id)
-        response = try_request_n_retries(request, self.max_retries)
+        response = self.execute(request, 'get_current_poll')
 
         poll_dict = response['response'].get('result', {})
-        #end getting the poll/response data code
-
-        #start getting the response location data
-        range_string = get_a1_notation(self.info_spread_names[3],
-                                       self.poll_id_position[0], self.poll_id_position[1] + 1,
-                                       self.location_width, len(poll_dict['options']) + 1)
-        request = self.service.sheets().spreadsheets().values().get(
-            majorDimension='ROWS', spreadsheetId=user_sheet_id, range=range_string)
-        response = try_request_n_retries(request, self.max_retries)
-        values = response.get('values', [])
-        #end getting the response location data code
+        if pending_locations is not None:
+            location_dict = pending_locations.result()
+        #end getting the poll/response data and the response location data code
 
         #start parsing poll/response/location data
-        location_dict = {}
-        for row in values:
-            location_dict[row[0]] = FormLocation(row[1], row[2])
-
         options = []
         scores = []
         for i in range(len(poll_dict['options'])):
@@ -642,7 +1877,12 @@ class GoogleDocsBot(books_common.DataIO):
             title, author = id_string.split(self.title_sep, maxsplit=1)
             last, first = author.split(self.author_sep, maxsplit=1)
 
-            options.append(books_common.Book(title, first, last, location_dict[id_string], self))
+            #the same key as in make_books, so an option is the same object as the user's book
+            form_id = location_dict[id_string].get_form_id()
+            response_id = location_dict[id_string].get_response_id()
+            options.append(self.identity_map.get_book(
+                (form_id, response_id), title, first, last,
+                functools.partial(FormLocation, form_id, response_id), self))
             scores.append(int(poll_dict['scores'][i]))
 
         date = books_common.Date(int(poll_dict['date']['year']),
@@ -652,6 +1892,19 @@ class GoogleDocsBot(books_common.DataIO):
 
         return books_common.Poll(options, scores, poll_dict['url'], current_poll_id, date, self)
 
+    def get_poll_scores(self, poll_id):
+        '''Returns the scores of a poll and the number of responses it has received.'''
+
+        getscores_function = {"function": "getPollScores", "parameters": [poll_id]}
+        request = self.service.appsscript().scripts().run(
+            body=getscores_function, scriptId=self.script_id)
+        response = self.execute(request, 'get_poll_scores')
+
+        scores_dict = response['response'].get('result', {})
+        scores = [int(score) for score in scores_dict.get('scores', [])]
+
+        return scores, int(scores_dict.get('responseCount', sum(scores)))
+
     def new_poll(self, options):
         '''Replaces the old poll with the provided poll.
         close_poll should often be called on the old poll first.'''
@@ -673,7 +1926,7 @@ class GoogleDocsBot(books_common.DataIO):
                              "parameters": [self.service_email, string_options]}
         makepoll_request = self.service.appsscript().scripts().run(
             body=makepoll_function, scriptId=self.script_id)
-        makepoll_response = try_request_n_retries(makepoll_request, self.max_retries)
+        makepoll_response = self.execute(makepoll_request, 'new_poll')
 
         pollform_dict = makepoll_response['response'].get('result', {})
         poll_link = pollform_dict['form_url']
@@ -693,9 +1946,14 @@ class GoogleDocsBot(books_common.DataIO):
         update_request = self.service.sheets().spreadsheets().values().update(
             spreadsheetId=user_sheet_id, range=range_string,
             valueInputOption='RAW', body=update_body)
-        update_response = try_request_n_retries(update_request, self.max_retries)
+        update_response = self.execute(update_request, 'new_poll')
         #end updating the poll id and location data code
 
+        self.cache.set_value(self.current_poll_id, poll_id)
+        self.cache.set_value(self.poll_locations,
+                             {row[0]: FormLocation(row[1], row[2]) for row in location_data})
+        self.record_own_write()
+
         #the poll was created now.
         now = time.localtime()
         date = books_common.Date(now.tm_year, now.tm_mon, now.tm_mday)
@@ -710,7 +1968,7 @@ class GoogleDocsBot(books_common.DataIO):
         closepoll_function = {"function": "closeForm", "parameters": [poll_id]}
         closepoll_request = self.service.appsscript().scripts().run(
             body=closepoll_function, scriptId=self.script_id)
-        closepoll_response = try_request_n_retries(closepoll_request, self.max_retries)
+        closepoll_response = self.execute(closepoll_request, 'close_poll')
 
         return not 'error' in closepoll_response
 
@@ -721,20 +1979,22 @@ class GoogleDocsBot(books_common.DataIO):
                           "parameters": [destination_address, subject, body]}
         email_request = self.service.appsscript().scripts().run(
             body=email_function, scriptId=self.script_id)
-        email_response = try_request_n_retries(email_request, self.max_retries)
+        email_response = self.execute(email_request, 'send_email')
 
         return not 'error' in email_response
 
     def remove_user(self, user):
         '''Removes all record of a user.'''
 
-        user_info = self.get_user_table()
+        user_info = dict(self.get_user_table())
         user_name = user.get_user_name()
         if not user_name in user_info:
             return False
 
         form_id = user_info[user_name][3]
         self.delete_doc(form_id)
+        self.forget_books(form_id)
+        self.identity_map.forget_user(user_name)
 
         #start rewriting of user records
         update_length = len(user_info)
@@ -751,10 +2011,11 @@ class GoogleDocsBot(books_common.DataIO):
             spreadsheetId=self.get_book_club_info_sheet_id(), range=range_string,
             valueInputOption='RAW', body=update_body)
 
-        update_response = try_request_n_retries(update_request, self.max_retries)
+        update_response = self.execute(update_request, 'remove_user')
         #end rewriting of user records code
 
         self.cache.set_value(self.user_table, user_info)
+        self.record_own_write()
         return not 'error' in update_response
 
     def delete_doc(self, doc_id):
@@ -764,7 +2025,7 @@ class GoogleDocsBot(books_common.DataIO):
                         "parameters": [doc_id]}
         del_request = self.service.appsscript().scripts().run(
             body=del_function, scriptId=self.script_id)
-        del_response = try_request_n_retries(del_request, self.max_retries)
+        del_response = self.execute(del_request, 'delete_doc')
 
         return not 'error' in del_response
 
@@ -773,18 +2034,7 @@ class GoogleDocsBot(books_common.DataIO):
 
         #start obtaining the current poll id
         user_sheet_id = self.get_book_club_info_sheet_id()
-
-        range_string = get_a1_notation(self.info_spread_names[3],
-                                       self.poll_id_position[0], self.poll_id_position[1],
-                                       self.poll_id_position[0], self.poll_id_position[1])
-        request = self.service.sheets().spreadsheets().values().get(
-            majorDimension='ROWS', spreadsheetId=user_sheet_id, range=range_string)
-        result = try_request_n_retries(request, self.max_retries)
-        values = result.get('values', [])
-
-        current_poll_id = ''
-        if values and values[0] and values[0][0]:
-            current_poll_id = values[0][0]
+        current_poll_id = self.get_current_poll_id()
         #end obtaining the current poll id code
 
         #delete the doc
@@ -792,6 +2042,9 @@ class GoogleDocsBot(books_common.DataIO):
 
         #maybe clear the id
         if current_poll_id == poll_id:
+            range_string = get_a1_notation(self.info_spread_names[3],
+                                           self.poll_id_position[0], self.poll_id_position[1],
+                                           self.poll_id_position[0], self.poll_id_position[1])
             update_body = {
                 "range": range_string,
                 "majorDimension": "ROWS",
@@ -800,8 +2053,101 @@ class GoogleDocsBot(books_common.DataIO):
             update_request = self.service.sheets().spreadsheets().values().update(
                 spreadsheetId=user_sheet_id, range=range_string,
                 valueInputOption='RAW', body=update_body)
-            update_response = try_request_n_retries(update_request, self.max_retries)
+            update_response = self.execute(update_request, 'delete_poll')
+
+            self.cache.set_value(self.current_poll_id, '')
+            self.cache.set_value(self.poll_locations, {})
+            self.record_own_write()
 
             return not 'error' in update_response
 
         return True
+
+class AsyncGoogleDocsBot(books_common.AsyncDataIO):
+    '''A class that makes the functions of a GoogleDocsBot awaitable.
+    The Google client libraries block, so each call runs on a worker thread, and no more
+    than max_concurrency calls run at once.'''
+
+    def __init__(self, bot, max_concurrency=8):
+        super().__init__()
+
+        if isinstance(bot, GoogleDocsBot):
+            self.bot = bot
+        else:
+            raise TypeError("Provided bot not a GoogleDocsBot object.")
+
+        if isinstance(max_concurrency, int) and max_concurrency > 0:
+            self.max_concurrency = max_concurrency
+        else:
+            raise TypeError("Provided concurrency limit not a positive number.")
+
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    async def run(self, function, *args):
+        '''Runs a blocking function on a worker thread and waits for the result.'''
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args))
+
+    async def get_user_names(self):
+        '''See GoogleDocsBot.get_user_names.'''
+        return await self.run(self.bot.get_user_names)
+
+    async def get_user_info(self, username):
+        '''See GoogleDocsBot.get_user_info.'''
+        return await self.run(self.bot.get_user_info, username)
+
+    async def get_user_books(self, user):
+        '''See GoogleDocsBot.get_user_books.'''
+        return await self.run(self.bot.get_user_books, user)
+
+    async def get_books_for_users(self, users):
+        '''See GoogleDocsBot.get_books_for_users.'''
+        return await self.run(self.bot.get_books_for_users, users)
+
+    async def get_history(self):
+        '''See GoogleDocsBot.get_history.'''
+        return await self.run(self.bot.get_history)
+
+    async def get_current_poll(self):
+        '''See GoogleDocsBot.get_current_poll.'''
+        return await self.run(self.bot.get_current_poll)
+
+    async def get_poll_scores(self, poll_id):
+        '''See GoogleDocsBot.get_poll_scores.'''
+        return await self.run(self.bot.get_poll_scores, poll_id)
+
+    async def create_user(self, username, user_email):
+        '''See GoogleDocsBot.create_user.'''
+        return await self.run(self.bot.create_user, username, user_email)
+
+    async def remove_book(self, book):
+        '''See GoogleDocsBot.remove_book.'''
+        return await self.run(self.bot.remove_book, book)
+
+    async def remove_all_books(self, user):
+        '''See GoogleDocsBot.remove_all_books.'''
+        return await self.run(self.bot.remove_all_books, user)
+
+    async def new_poll(self, options):
+        '''See GoogleDocsBot.new_poll.'''
+        return await self.run(self.bot.new_poll, options)
+
+    async def close_poll(self, poll):
+        '''See GoogleDocsBot.close_poll.'''
+        return await self.run(self.bot.close_poll, poll)
+
+    async def add_winner(self, book):
+        '''See GoogleDocsBot.add_winner.'''
+        return await self.run(self.bot.add_winner, book)
+
+    async def send_email(self, destination_address, subject, body):
+        '''See GoogleDocsBot.send_email.'''
+        return await self.run(self.bot.send_email, destination_address, subject, body)
+
+    async def remove_user(self, user):
+        '''See GoogleDocsBot.remove_user.'''
+        return await self.run(self.bot.remove_user, user)
+
+    async def delete_poll(self, poll_id):
+        '''See GoogleDocsBot.delete_poll.'''
+        return await self.run(self.bot.delete_poll, poll_id)
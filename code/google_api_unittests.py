@@ -1,7 +1,14 @@
 '''This is the unit test file for the google_api.py file.'''
 
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 import google_api
+import httplib2
 from apiclient import errors
 
 class Request():
@@ -16,14 +23,22 @@ class Request():
         return self.count
 
 class RequestHTTP(Request):
+    def __init__(self, status=503, headers=None):
+        super().__init__()
+        self.response = httplib2.Response(dict(headers or {}, status=status))
+
     def execute(self):
         self.count += 1
-        raise errors.HttpError('Test error', b'HTTP/1.1 404 Not Found.')
+        raise errors.HttpError(self.response, b'Test error')
 
 class RequestApps(Request):
+    def __init__(self, message='Test error'):
+        super().__init__()
+        self.message = message
+
     def execute(self):
         self.count += 1
-        return {'error': {'details': ['Test error']}}
+        return {'error': {'details': [self.message]}}
 
 class TestGeneralMethods(unittest.TestCase):
     def test_try_request_n_retries(self):
@@ -37,21 +52,296 @@ class TestGeneralMethods(unittest.TestCase):
         self.assertRaises(errors.HttpError, google_api.try_request_n_retries, req, 5, retry_time=0)
         self.assertEqual(req.get_count(), 5)
 
+    def test_try_request_n_retries_permanent_http_error(self):
+        req = RequestHTTP(404)
+        self.assertRaises(errors.HttpError, google_api.try_request_n_retries, req, 5, retry_time=0)
+        self.assertEqual(req.get_count(), 1)
+
     def test_try_request_n_retries_appsscript_error(self):
         req = RequestApps()
         self.assertRaises(google_api.AppsScriptError, google_api.try_request_n_retries, req, 5, retry_time=0)
         self.assertEqual(req.get_count(), 5)
 
+    def test_try_request_n_retries_permanent_appsscript_error(self):
+        req = RequestApps('Script function not found: getBookLists')
+        self.assertRaises(google_api.AppsScriptError, google_api.try_request_n_retries, req, 5, retry_time=0)
+        self.assertEqual(req.get_count(), 1)
+
     def test_column_number_to_letter(self):
         tests = [(1,'A'),(2,'B'),(3,'C'),(27,'AA'),(28,'AB'),(703,'AAA')]
         for test in tests:
             self.assertEqual(google_api.column_number_to_letter(test[0]), test[1])
 
+    def test_get_row_windows(self):
+        windows = google_api.get_row_windows(100, 10, 2)
+        self.assertEqual(windows, [(1, 10), (11, 30), (31, 70), (71, 100)])
+
+        windows = google_api.get_row_windows(5, 10, 2)
+        self.assertEqual(windows, [(1, 5)])
+
+        windows = google_api.get_row_windows(0, 10, 2)
+        self.assertEqual(windows, [])
+
     def test_get_a1_notation(self):
         a1_t = google_api.get_a1_notation('sheet_name', 1, 1, 2, 2)
         a1 = "'sheet_name'!A1:B2"
         self.assertEqual(a1, a1_t)
 
+class TestRetryPolicyMethods(unittest.TestCase):
+    def test_is_transient(self):
+        policy = google_api.RetryPolicy()
+        self.assertTrue(policy.is_transient(errors.HttpError(httplib2.Response({'status': 429}), b'')))
+        self.assertTrue(policy.is_transient(errors.HttpError(httplib2.Response({'status': 503}), b'')))
+        self.assertFalse(policy.is_transient(errors.HttpError(httplib2.Response({'status': 400}), b'')))
+        self.assertFalse(policy.is_transient(errors.HttpError(httplib2.Response({'status': 403}), b'')))
+        self.assertTrue(policy.is_transient(errors.HttpError(httplib2.Response({'status': 403}), b'"reason": "userRateLimitExceeded"')))
+        self.assertTrue(policy.is_transient(google_api.AppsScriptError('Service invoked too many times')))
+        self.assertFalse(policy.is_transient(ValueError()))
+
+        refused_only = google_api.RetryPolicy(transient_statuses=[429])
+        self.assertFalse(refused_only.is_transient(errors.HttpError(httplib2.Response({'status': 503}), b'')))
+
+    def test_is_transient_refused_only(self):
+        policy = google_api.RetryPolicy(transient_statuses=[429], refused_only=True)
+        self.assertTrue(policy.is_transient(errors.HttpError(httplib2.Response({'status': 429}), b'')))
+        self.assertTrue(policy.is_transient(google_api.AppsScriptError('Service invoked too many times')))
+        self.assertFalse(policy.is_transient(google_api.AppsScriptError('Exceeded maximum execution time')))
+        self.assertFalse(policy.is_transient(google_api.AppsScriptError('Test error')))
+
+        req = RequestApps('Test error')
+        self.assertRaises(google_api.AppsScriptError, policy.execute, req)
+        self.assertEqual(req.get_count(), 1)
+
+    def test_get_delay(self):
+        policy = google_api.RetryPolicy(base_delay=1, max_delay=4)
+        error = google_api.AppsScriptError('Test error')
+        for attempt, backoff in [(1, 1), (2, 2), (3, 4), (4, 4)]:
+            delay = policy.get_delay(attempt, error)
+            self.assertGreaterEqual(delay, backoff / 2)
+            self.assertLessEqual(delay, backoff)
+
+    def test_get_delay_retry_after(self):
+        policy = google_api.RetryPolicy(base_delay=0)
+        error = errors.HttpError(httplib2.Response({'status': 429, 'retry-after': '7'}), b'')
+        self.assertEqual(policy.get_delay(1, error), 7)
+
+    def test_execute_deadline(self):
+        policy = google_api.RetryPolicy(max_tries=5, base_delay=10, deadline=1)
+        req = RequestHTTP(503)
+        self.assertRaises(errors.HttpError, policy.execute, req)
+        self.assertEqual(req.get_count(), 1)
+
+class FakeHttpRequest():
+    def __init__(self, uri, method='GET', body=None):
+        self.uri = uri
+        self.method = method
+        self.body = body
+
+class TestRateLimitMethods(unittest.TestCase):
+    def test_get_request_api(self):
+        tests = [(FakeHttpRequest('https://www.googleapis.com/drive/v3/files'), 'drive'),
+                 (FakeHttpRequest('https://sheets.googleapis.com/v4/spreadsheets/id/values/A1'), 'sheets_read'),
+                 (FakeHttpRequest('https://sheets.googleapis.com/v4/spreadsheets/id/values/A1', 'PUT'), 'sheets_write'),
+                 (FakeHttpRequest('https://script.googleapis.com/v1/scripts/id:run', 'POST', '{"function": "getBookList"}'), 'appsscript'),
+                 (FakeHttpRequest('https://script.googleapis.com/v1/scripts/id:run', 'POST', '{"function": "sendEmail"}'), 'gmail')]
+        for test in tests:
+            self.assertEqual(google_api.get_request_api(test[0]), test[1])
+
+    def test_token_bucket(self):
+        bucket = google_api.TokenBucket(60, capacity=2)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        wait = bucket.try_acquire()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1)
+
+    def test_token_bucket_default_capacity(self):
+        self.assertEqual(google_api.TokenBucket(600).capacity, 60)
+        self.assertEqual(google_api.TokenBucket(5).capacity, 1)
+
+    def test_token_bucket_fail_bad_rate(self):
+        with self.assertRaises(ValueError):
+            google_api.TokenBucket(0)
+
+    def test_rate_limiter(self):
+        limiter = google_api.RateLimiter({'drive': 120, 'gmail': None})
+        self.assertEqual(limiter.buckets['drive'].capacity, 12)
+        self.assertNotIn('gmail', limiter.buckets)
+        self.assertIn('sheets_read', limiter.buckets)
+        limiter.acquire('gmail')
+        limiter.acquire('unknown api')
+
+class TestConcurrencyLimiterMethods(unittest.TestCase):
+    def setUp(self):
+        self.limiter = google_api.ConcurrencyLimiter()
+
+    def tearDown(self):
+        del self.limiter
+
+    def test_increase(self):
+        start_limit = self.limiter.get_limit()
+        for i in range(start_limit * 2):
+            self.limiter.acquire()
+            self.limiter.release(0)
+        self.assertGreater(self.limiter.get_limit(), start_limit)
+
+    def test_no_increase_when_slow(self):
+        start_limit = self.limiter.get_limit()
+        for i in range(start_limit * 2):
+            self.limiter.acquire()
+            self.limiter.release(self.limiter.target_latency + 1)
+        self.assertEqual(self.limiter.get_limit(), start_limit)
+
+    def test_decrease(self):
+        start_limit = self.limiter.get_limit()
+        self.limiter.acquire()
+        self.limiter.release(0, google_api.AppsScriptError('too many simultaneous invocations'))
+        self.assertEqual(self.limiter.get_limit(), int(start_limit * self.limiter.backoff_ratio))
+
+        for i in range(10):
+            self.limiter.acquire()
+            self.limiter.release(0, errors.HttpError(httplib2.Response({'status': 429}), b''))
+        self.assertEqual(self.limiter.get_limit(), self.limiter.min_limit)
+
+    def test_limited_request(self):
+        req = RequestApps('too many simultaneous invocations')
+        start_limit = self.limiter.get_limit()
+        google_api.LimitedRequest(req, self.limiter).execute()
+        self.assertEqual(req.get_count(), 1)
+        self.assertEqual(self.limiter.in_flight, 0)
+        self.assertLess(self.limiter.get_limit(), start_limit)
+
+    def test_limited_request_timeout(self):
+        class RequestTimeout(Request):
+            def execute(self):
+                self.count += 1
+                raise TimeoutError('timed out')
+
+        start_limit = self.limiter.get_limit()
+        for i in range(start_limit * 2):
+            self.assertRaises(TimeoutError,
+                              google_api.LimitedRequest(RequestTimeout(), self.limiter).execute)
+        self.assertEqual(self.limiter.in_flight, 0)
+        self.assertEqual(self.limiter.get_limit(), start_limit)
+
+class TestSingleFlightMethods(unittest.TestCase):
+    def setUp(self):
+        self.single_flight = google_api.SingleFlight()
+        self.started = threading.Event()
+        self.finish = threading.Event()
+        self.calls = 0
+
+    def tearDown(self):
+        del self.single_flight
+
+    def slow_call(self, value):
+        self.calls += 1
+        self.started.set()
+        self.finish.wait(5)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def run_together(self, value):
+        results = []
+        def follower():
+            try:
+                results.append(self.single_flight.do('key', self.slow_call, value))
+            except ValueError as error:
+                results.append(error)
+
+        leader = threading.Thread(target=follower)
+        leader.start()
+        self.started.wait(5)
+        others = [threading.Thread(target=follower) for _ in range(3)]
+        for other in others:
+            other.start()
+        while self.single_flight.shared_calls < 3:
+            time.sleep(0.001)
+        self.finish.set()
+        for thread in [leader] + others:
+            thread.join()
+
+        return results
+
+    def test_shared_result(self):
+        self.assertEqual(self.run_together('result'), ['result'] * 4)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.single_flight.shared_calls, 3)
+        self.assertEqual(self.single_flight.calls, {})
+
+    def test_shared_exception(self):
+        error = ValueError('failed')
+        self.assertEqual(self.run_together(error), [error] * 4)
+        self.assertEqual(self.calls, 1)
+
+    def test_sequential_calls(self):
+        self.finish.set()
+        self.assertEqual(self.single_flight.do('key', self.slow_call, 1), 1)
+        self.assertEqual(self.single_flight.do('key', self.slow_call, 2), 2)
+        self.assertEqual(self.calls, 2)
+
+class FakeCredentials():
+    '''Stands in for stored OAuth credentials, counting refreshes.'''
+    def __init__(self, lifetime):
+        self.token_expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=lifetime)
+        self.refreshes = 0
+
+    def refresh(self, http): # pylint: disable=unused-argument
+        self.refreshes += 1
+        self.token_expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+class TestTokenRefresherMethods(unittest.TestCase):
+    def setUp(self):
+        self.credential_dir = tempfile.mkdtemp()
+        self.credential_path = os.path.join(self.credential_dir, 'cred')
+
+    def tearDown(self):
+        shutil.rmtree(self.credential_dir)
+
+    def test_get_delay(self):
+        refresher = google_api.TokenRefresher(FakeCredentials(3600), self.credential_path)
+        self.assertAlmostEqual(refresher.get_delay(), 3600 - refresher.margin, delta=5)
+
+        refresher.credentials = FakeCredentials(-10)
+        self.assertEqual(refresher.get_delay(), 0)
+
+        refresher.credentials.token_expiry = None
+        self.assertIsNone(refresher.get_delay())
+
+    def test_refresh(self):
+        refresher = google_api.TokenRefresher(FakeCredentials(60), self.credential_path)
+        self.assertTrue(refresher.refresh())
+        self.assertFalse(refresher.refresh())
+        self.assertEqual(refresher.credentials.refreshes, 1)
+        self.assertTrue(os.path.exists(self.credential_path + '.lock'))
+
+    def test_start(self):
+        refresher = google_api.TokenRefresher(FakeCredentials(60), self.credential_path)
+        refresher.start()
+        while refresher.credentials.refreshes == 0:
+            time.sleep(0.001)
+        refresher.stop()
+        refresher.thread.join(5)
+        self.assertFalse(refresher.thread.is_alive())
+        self.assertEqual(refresher.credentials.refreshes, 1)
+
+class TestAdminEmailMethods(unittest.TestCase):
+    def setUp(self):
+        self.bot = google_api.GoogleDocsBot.__new__(google_api.GoogleDocsBot)
+        self.bot.credential_name = 'cred'
+        self.bot.known_admin_email = None
+        self.bot.disk_cache = google_api.DiskCache(':memory:')
+
+    def tearDown(self):
+        self.bot.disk_cache.close()
+        del self.bot
+
+    def test_saved_email(self):
+        self.bot.disk_cache.set(self.bot.admin_email_name, 'admin@example.com', 'cred')
+        self.assertEqual(self.bot.admin_email, 'admin@example.com')
+        self.assertEqual(self.bot.known_admin_email, 'admin@example.com')
+
 class TestServicesMethods(unittest.TestCase):
     def setUp(self):
         self.drive = 'drive_service'
@@ -74,6 +364,39 @@ class TestServicesMethods(unittest.TestCase):
     def test_appsscript(self):
         self.assertEqual(self.appsscript, self.service.appsscript())
 
+class TestThreadLocalServicesMethods(unittest.TestCase):
+    def setUp(self):
+        self.service = google_api.ThreadLocalServices(object, object, object)
+
+    def tearDown(self):
+        del self.service
+
+    def test_same_thread(self):
+        self.assertIs(self.service.drive(), self.service.drive())
+        self.assertIs(self.service.sheets(), self.service.sheets())
+        self.assertIs(self.service.appsscript(), self.service.appsscript())
+        self.assertIsNot(self.service.drive(), self.service.sheets())
+
+    def test_other_thread(self):
+        other_services = []
+        thread = threading.Thread(target=lambda: other_services.append(self.service.drive()))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(len(other_services), 1)
+        self.assertIsNot(self.service.drive(), other_services[0])
+
+    def test_seed(self):
+        self.service.seed('drive_service', 'sheets_service', 'appsscript_service')
+        self.assertEqual(self.service.drive(), 'drive_service')
+        self.assertEqual(self.service.appsscript(), 'appsscript_service')
+
+        other_services = []
+        thread = threading.Thread(target=lambda: other_services.append(self.service.drive()))
+        thread.start()
+        thread.join()
+        self.assertNotEqual(other_services[0], 'drive_service')
+
 class TestCacheMethods(unittest.TestCase):
     def setUp(self):
         self.name = 'name'
@@ -126,6 +449,56 @@ class TestCacheMethods(unittest.TestCase):
         value = self.invalid_cache.get_value(self.name)
         self.assertIsNone(value)
 
+    def test_is_fresh_max_age(self):
+        self.assertTrue(self.valid_cache.is_fresh(self.name, max_age=60))
+        self.assertFalse(self.valid_cache.is_fresh(self.name, max_age=-1))
+        self.assertTrue(self.valid_cache.is_fresh(self.name))
+
+    def test_set_value_ttl(self):
+        self.empty_cache.set_value(self.name, self.value, ttl=-1)
+        self.assertFalse(self.empty_cache.is_fresh(self.name))
+        self.assertIsNone(self.empty_cache.get_value(self.name))
+
+        self.empty_cache.set_value(self.name, self.value, ttl=60)
+        self.assertTrue(self.empty_cache.is_fresh(self.name))
+        self.assertEqual(self.empty_cache.get_value(self.name), self.value)
+
+    def test_max_size(self):
+        cache = google_api.Cache(max_size=2)
+        cache.set_value('a', 1)
+        cache.set_value('b', 2)
+        self.assertTrue(cache.is_fresh('a'))
+        cache.set_value('c', 3)
+
+        self.assertTrue(cache.is_fresh('a'))
+        self.assertFalse(cache.is_fresh('b'))
+        self.assertTrue(cache.is_fresh('c'))
+        self.assertEqual(cache.get_stats()['evictions'], 1)
+        self.assertEqual(cache.get_stats()['size'], 2)
+
+    def test_max_size_pinned(self):
+        cache = google_api.Cache(max_size=2, pinned=['user_table'])
+        cache.set_value('user_table', {})
+        for form_id in range(600):
+            cache.set_value('books/' + str(form_id), [])
+
+        self.assertTrue(cache.is_fresh('user_table'))
+        self.assertTrue(cache.is_fresh('books/599'))
+        self.assertFalse(cache.is_fresh('books/597'))
+        self.assertEqual(cache.get_stats()['evictions'], 598)
+        self.assertEqual(cache.get_stats()['size'], 3)
+
+    def test_get_stats(self):
+        self.valid_cache.is_fresh(self.name)
+        self.valid_cache.is_fresh('missing name')
+        self.valid_cache.is_fresh('missing name')
+
+        stats = self.valid_cache.get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['evictions'], 0)
+        self.assertEqual(stats['size'], 1)
+
     def test_timeout_var(self):
         self.empty_cache.timeout_var(self.name)
         self.assertNotIn(self.name, self.empty_cache.cache)
@@ -138,6 +511,51 @@ class TestCacheMethods(unittest.TestCase):
         self.assertIn(self.name, self.invalid_cache.cache)
         self.assertEqual(self.invalid_cache.cache[self.name], (False, self.value))
 
+    def test_get_stale(self):
+        self.assertIsNone(self.empty_cache.get_stale(self.name))
+        self.assertEqual(self.valid_cache.get_stale(self.name), self.value)
+        self.assertEqual(self.invalid_cache.get_stale(self.name), self.value)
+
+    def test_forget(self):
+        self.valid_cache.forget(self.name)
+        self.assertNotIn(self.name, self.valid_cache.cache)
+        self.assertIsNone(self.valid_cache.get_stale(self.name))
+
+        self.empty_cache.forget(self.name)
+        self.assertNotIn(self.name, self.empty_cache.cache)
+
+class TestDiskCacheMethods(unittest.TestCase):
+    def setUp(self):
+        self.disk_cache = google_api.DiskCache(':memory:')
+        self.disk_cache.set('name', {'key': ['value']}, 3)
+
+    def tearDown(self):
+        self.disk_cache.close()
+        del self.disk_cache
+
+    def test_get(self):
+        self.assertEqual(self.disk_cache.get('name', 3), {'key': ['value']})
+        self.assertEqual(self.disk_cache.get('name', '3'), {'key': ['value']})
+        self.assertIsNone(self.disk_cache.get('name', 4))
+        self.assertIsNone(self.disk_cache.get('name', None))
+        self.assertIsNone(self.disk_cache.get('other name', 3))
+
+    def test_set(self):
+        self.disk_cache.set('name', 'new value', 4)
+        self.assertEqual(self.disk_cache.get('name', 4), 'new value')
+        self.assertIsNone(self.disk_cache.get('name', 3))
+
+        self.disk_cache.set('name', 'unversioned value', None)
+        self.assertIsNone(self.disk_cache.get('name', 4))
+
+    def test_delete(self):
+        self.disk_cache.delete('name')
+        self.assertIsNone(self.disk_cache.get('name', 3))
+
+    def test_schema_version(self):
+        self.disk_cache.schema_version += 1
+        self.assertIsNone(self.disk_cache.get('name', 3))
+
 class TestFormLocationMethods(unittest.TestCase):
     def setUp(self):
         self.form_id_1 = 'form id # 1'
@@ -200,7 +618,462 @@ class TestFormLocationMethods(unittest.TestCase):
 
         self.assertTrue(self.loc_2_2.compare(self.loc_2_2))
 
-# Not sure how to write unit tests for the GoogleDocsBot class...
+class FakeDriveChanges():
+    '''Stands in for the Drive service, answering every changes request from a list of pages.'''
+    def __init__(self, pages):
+        self.pages = pages
+
+    def drive(self):
+        return self
+
+    def changes(self):
+        return self
+
+    def getStartPageToken(self):
+        return {'startPageToken': 'start'}
+
+    def list(self, pageToken, **kwargs): # pylint: disable=unused-argument
+        return self.pages[pageToken]
+
+class TestRefreshChangesMethods(unittest.TestCase):
+    def setUp(self):
+        self.bot = google_api.GoogleDocsBot.__new__(google_api.GoogleDocsBot)
+        self.bot.cache = google_api.Cache()
+        self.bot.disk_cache = None
+        self.bot.page_token = None
+        self.bot.changes_seen = 0
+        self.bot.own_sheet_version = None
+        self.bot.execute = lambda request, method_name: request
+        self.bot.service = FakeDriveChanges({
+            'start': {'nextPageToken': 'next', 'changes': [{'fileId': 'sheet'}]},
+            'next': {'newStartPageToken': 'end', 'changes': [{'fileId': 'form'}]}})
+
+        self.bot.cache.set_value(self.bot.book_club_sheet_id, 'sheet')
+        self.bot.cache.set_value(self.bot.user_table, {})
+        self.bot.cache.set_value(self.bot.books_name('form'), [])
+        self.bot.cache.set_value(self.bot.books_name('other form'), [])
+
+    def tearDown(self):
+        del self.bot
+
+    def test_first_refresh(self):
+        self.assertEqual(self.bot.refresh_changes(), set())
+        self.assertEqual(self.bot.page_token, 'start')
+        self.assertTrue(self.bot.cache.is_fresh(self.bot.user_table))
+
+    def test_refresh(self):
+        self.bot.page_token = 'start'
+        self.assertEqual(self.bot.refresh_changes(), {'sheet', 'form'})
+        self.assertEqual(self.bot.page_token, 'end')
+        self.assertEqual(self.bot.changes_seen, 1)
+        self.assertFalse(self.bot.cache.is_fresh(self.bot.user_table))
+        self.assertFalse(self.bot.cache.is_fresh(self.bot.books_name('form')))
+        self.assertTrue(self.bot.cache.is_fresh(self.bot.books_name('other form')))
+
+    def test_refresh_own_write(self):
+        self.bot.page_token = 'start'
+        self.bot.own_sheet_version = 7
+        self.bot.service.pages['start']['changes'] = [{'fileId': 'sheet', 'file': {'version': '7'}}]
+        self.assertEqual(self.bot.refresh_changes(), {'form'})
+        self.assertTrue(self.bot.cache.is_fresh(self.bot.user_table))
+
+        self.bot.page_token = 'start'
+        self.bot.service.pages['start']['changes'] = [{'fileId': 'sheet', 'file': {'version': '8'}}]
+        self.assertEqual(self.bot.refresh_changes(), {'sheet', 'form'})
+        self.assertFalse(self.bot.cache.is_fresh(self.bot.user_table))
+
+class FakeSheetsAppend():
+    '''Stands in for the Sheets service, recording appends and answering with the stored row.'''
+    def __init__(self):
+        self.appends = []
+
+    def sheets(self):
+        return self
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def append(self, **kwargs):
+        self.appends.append(kwargs)
+        return {'updates': {'updatedData': {'values': kwargs['body']['values']}}}
+
+class TestAppendRowMethods(unittest.TestCase):
+    def setUp(self):
+        self.bot = google_api.GoogleDocsBot.__new__(google_api.GoogleDocsBot)
+        self.bot.cache = google_api.Cache()
+        self.bot.service = FakeSheetsAppend()
+        self.bot.execute = lambda request, method_name: request
+        self.bot.get_book_club_info_sheet_id = lambda: 'sheet'
+        self.bot.get_file_versions = lambda file_ids: {'sheet': '7'}
+        self.bot.own_sheet_version = None
+        self.book = google_api.books_common.Book('title', 'first', 'last', None, self.bot)
+
+    def tearDown(self):
+        del self.bot
+        del self.book
+
+    def test_append_row(self):
+        self.assertEqual(self.bot.append_row('Sheet', 2, ['a', 'b'], 'test'), ['a', 'b'])
+        append = self.bot.service.appends[0]
+        self.assertEqual(append['range'], "'Sheet'!A1:B1")
+        self.assertEqual(append['insertDataOption'], 'INSERT_ROWS')
+
+    def test_add_winner(self):
+        self.bot.cache.set_value(self.bot.history, [['2000/01/01', 'old', 'first', 'last']])
+        self.assertTrue(self.bot.add_winner(self.book))
+        history = self.bot.cache.get_value(self.bot.history)
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history[1][1:], ['title', 'first', 'last'])
+        self.assertEqual(self.bot.own_sheet_version, 7)
+
+    def test_add_winner_stale_history(self):
+        self.bot.cache.set_value(self.bot.history, [])
+        self.bot.cache.timeout_var(self.bot.history)
+        self.bot.add_winner(self.book)
+        self.assertFalse(self.bot.cache.is_fresh(self.bot.history))
+        self.assertEqual(len(self.bot.cache.get_stale(self.bot.history)), 1)
+
+    def test_add_winner_error(self):
+        self.bot.cache.set_value(self.bot.history, [])
+        self.bot.execute = lambda request, method_name: {'error': {'message': 'Test error'}}
+        self.assertFalse(self.bot.add_winner(self.book))
+        self.assertEqual(self.bot.cache.get_value(self.bot.history), [])
+
+    def test_add_winner_no_history(self):
+        self.bot.add_winner(self.book)
+        self.assertIsNone(self.bot.cache.get_stale(self.bot.history))
+
+    def test_create_user_exists(self):
+        self.bot.should_print = False
+        self.bot.cache.set_value(self.bot.user_table, {'name': ['name']})
+        self.assertFalse(self.bot.create_user('name', 'an.email@example.com'))
+        self.assertEqual(self.bot.service.appends, [])
+
+    def test_create_user_exists_cold_cache(self):
+        self.bot.should_print = False
+        self.bot.get_user_table = lambda: {'name': ['name']}
+        self.assertFalse(self.bot.create_user('name', 'an.email@example.com'))
+        self.assertEqual(self.bot.service.appends, [])
+
+class FakeScriptRun():
+    '''Stands in for the Apps Script service, answering every run with the same result.'''
+    def __init__(self, result):
+        self.result = result
+
+    def appsscript(self):
+        return self
+
+    def scripts(self):
+        return self
+
+    def run(self, **kwargs): # pylint: disable=unused-argument
+        return {'response': {'result': self.result}}
+
+class TestCurrentPollMethods(unittest.TestCase):
+    def setUp(self):
+        self.bot = google_api.GoogleDocsBot.__new__(google_api.GoogleDocsBot)
+        self.bot.script_id = 'script'
+        self.bot.cache = google_api.Cache()
+        self.bot.executor = google_api.ThreadPoolExecutor(max_workers=1)
+        self.bot.identity_map = google_api.books_common.IdentityMap()
+        self.bot.execute = lambda request, method_name: request
+        self.bot.get_current_poll_id = lambda: 'poll'
+        self.bot.get_poll_locations = lambda: {
+            'title\uff1a last, first': google_api.FormLocation('form', 'response')}
+        self.bot.service = FakeScriptRun({'options': ['title\uff1a last, first'],
+                                          'scores': ['3'],
+                                          'date': {'year': '2000', 'month': '1', 'day': '1'},
+                                          'url': 'www.example.com'})
+
+    def tearDown(self):
+        self.bot.executor.shutdown()
+        del self.bot
+
+    def test_get_current_poll_shares_books(self):
+        user_book = self.bot.make_books('form', [{'formResponseId': 'response', 'title': 'title',
+                                                  'authorFirstName': 'first',
+                                                  'authorLastName': 'last'}])[0]
+        poll = self.bot.get_current_poll()
+        self.assertIs(poll.options[0], user_book)
+        self.assertIs(self.bot.get_current_poll().options[0], user_book)
+
+    def test_get_current_poll_cached_locations(self):
+        self.bot.cache.set_value(self.bot.poll_locations, self.bot.get_poll_locations())
+        self.bot.get_poll_locations = None
+        self.bot.executor.shutdown()
+        poll = self.bot.get_current_poll()
+        self.assertEqual(poll.options[0].location.get_response_id(), 'response')
+
+class FakeSheetsGet():
+    '''Stands in for the Sheets service, answering each get with the rows in its range.'''
+    def __init__(self, rows):
+        self.rows = rows
+        self.threads = set()
+
+    def sheets(self):
+        return self
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, range, **kwargs): # pylint: disable=redefined-builtin,unused-argument
+        self.threads.add(threading.get_ident())
+        first, last = [int(cell.lstrip('ABCD')) for cell in range.split('!')[1].split(':')]
+        return {'values': self.rows[first - 1:last]}
+
+class TestFetchBookListsMethods(unittest.TestCase):
+    def setUp(self):
+        self.bot = google_api.GoogleDocsBot.__new__(google_api.GoogleDocsBot)
+        self.bot.cache = google_api.Cache()
+        self.bot.disk_cache = None
+        self.bot.bulk_executor = google_api.ThreadPoolExecutor(max_workers=2)
+        self.bot.service_email = 'bot@example.com'
+        self.bot.changes_seen = 0
+        self.bot.book_list_chunk_size = 2
+        self.bot.read_book_list_chunk = self.read_chunk
+        self.chunks = []
+        self.failing_ids = set()
+
+    def tearDown(self):
+        self.bot.bulk_executor.shutdown()
+        del self.bot
+
+    def read_chunk(self, form_ids):
+        self.chunks.append(form_ids)
+        if self.failing_ids.intersection(form_ids):
+            raise google_api.AppsScriptError('Exceeded maximum execution time')
+        return {form_id: [form_id] for form_id in form_ids}
+
+    def test_chunks(self):
+        raw_lists = self.bot.fetch_book_lists(['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(sorted(raw_lists.keys()), ['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(sorted(self.chunks), [['a', 'b'], ['c', 'd'], ['e']])
+        self.assertTrue(self.bot.cache.is_fresh(self.bot.books_name('e')))
+
+    def test_chunks_leave_shared_executor(self):
+        self.bot.executor = google_api.ThreadPoolExecutor(max_workers=1)
+        busy = threading.Event()
+        self.bot.executor.submit(busy.wait)
+        try:
+            raw_lists = self.bot.fetch_book_lists(['a', 'b', 'c'])
+            self.assertEqual(sorted(raw_lists.keys()), ['a', 'b', 'c'])
+        finally:
+            busy.set()
+            self.bot.executor.shutdown()
+
+    def test_saved_book_lists(self):
+        self.bot.disk_cache = google_api.DiskCache(':memory:')
+        self.bot.get_user_table = lambda: {'name': ['name', 'email', 'url', 'a']}
+        self.bot.fetch_book_lists(['a'])
+
+        self.bot.cache = google_api.Cache()
+        self.bot.load_saved_book_lists()
+        self.assertEqual(self.bot.cache.get_value(self.bot.books_name('a')), ['a'])
+        self.bot.disk_cache.close()
+
+    def test_changed_during_fetch(self):
+        self.bot.disk_cache = google_api.DiskCache(':memory:')
+        def read_chunk(form_ids):
+            self.bot.changes_seen += 1
+            return self.read_chunk(form_ids)
+        self.bot.read_book_list_chunk = read_chunk
+        self.bot.fetch_book_lists(['a'])
+        self.assertIsNone(self.bot.disk_cache.get(self.bot.books_name('a'), 'bot@example.com'))
+        self.bot.disk_cache.close()
+
+    def test_failed_chunk(self):
+        self.failing_ids = {'c'}
+        raw_lists = self.bot.fetch_book_lists(['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(sorted(raw_lists.keys()), ['a', 'b', 'e'])
+
+    def test_every_chunk_failed(self):
+        self.failing_ids = {'a', 'c'}
+        with self.assertRaises(google_api.AppsScriptError):
+            self.bot.fetch_book_lists(['a', 'b', 'c', 'd'])
+
+class FakeDriveBatch():
+    '''Stands in for the Drive service, answering batched files.get requests with versions.'''
+    def __init__(self, versions):
+        self.versions = versions
+        self.batches = []
+
+    def drive(self):
+        return self
+
+    def files(self):
+        return self
+
+    def get(self, fileId, fields): # pylint: disable=invalid-name,unused-argument
+        return fileId
+
+    def new_batch_http_request(self, callback):
+        drive = self
+
+        class Batch():
+            def __init__(self):
+                self.file_ids = []
+
+            def add(self, file_id):
+                self.file_ids.append(file_id)
+
+            def execute(self):
+                drive.batches.append(self.file_ids)
+                for file_id in self.file_ids:
+                    if file_id in drive.versions:
+                        callback(file_id, {'id': file_id, 'version': drive.versions[file_id]}, None)
+                    else:
+                        callback(file_id, None, Exception('Not found'))
+
+        return Batch()
+
+class TestFileVersionsMethods(unittest.TestCase):
+    def setUp(self):
+        self.bot = google_api.GoogleDocsBot.__new__(google_api.GoogleDocsBot)
+        self.bot.service = FakeDriveBatch({'a': '3', 'b': '5', 'c': '7'})
+        self.bot.execute = lambda request, method_name: request.execute()
+        self.bot.rate_limiter = google_api.RateLimiter()
+        self.bot.batch_size = 2
+
+    def tearDown(self):
+        del self.bot
+
+    def test_get_file_versions(self):
+        versions = self.bot.get_file_versions(['a', 'b', 'c', 'missing'])
+        self.assertEqual(versions, {'a': '3', 'b': '5', 'c': '7', 'missing': None})
+        self.assertEqual(self.bot.service.batches, [['a', 'b'], ['c', 'missing']])
+
+class TestSnapshotMethods(unittest.TestCase):
+    def setUp(self):
+        self.bot = google_api.GoogleDocsBot.__new__(google_api.GoogleDocsBot)
+        self.bot.cache = google_api.Cache()
+        self.global_values = [[' poll '],
+                              ['1', 'form', 'response 1'],
+                              ['2', 'form', 'response 2'],
+                              ['short row'],
+                              ['1', 'old form', 'old response'],
+                              ['3', 'old form', 'old response 3']]
+
+    def tearDown(self):
+        del self.bot
+
+    def test_parse_global_info(self):
+        poll_id, locations = self.bot.parse_global_info(self.global_values)
+        self.assertEqual(poll_id, 'poll')
+        self.assertEqual(sorted(locations.keys()), ['1', '2', '3'])
+        self.assertTrue(locations['1'].compare(google_api.FormLocation('form', 'response 1')))
+        self.assertTrue(locations['3'].compare(google_api.FormLocation('old form', 'old response 3')))
+
+    def test_parse_global_info_no_poll(self):
+        self.assertEqual(self.bot.parse_global_info([]), ('', {}))
+        self.assertEqual(self.bot.parse_global_info([[]]), ('', {}))
+        self.assertEqual(self.bot.parse_global_info([[''], ['1', 'form', 'response']]), ('', {}))
+
+    def test_set_snapshot(self):
+        user_values = [['user 1', 'email'], [], ['user 2', 'email']]
+        history_values = [['date', 'title'], [], ['date', 'other title']]
+        self.bot.set_snapshot(user_values, history_values, self.global_values)
+
+        self.assertEqual(self.bot.cache.get_value(self.bot.user_table),
+                         {'user 1': ['user 1', 'email'], 'user 2': ['user 2', 'email']})
+        self.assertEqual(self.bot.cache.get_value(self.bot.history),
+                         [['date', 'title'], ['date', 'other title']])
+        self.assertEqual(self.bot.cache.get_value(self.bot.current_poll_id), 'poll')
+        self.assertEqual(len(self.bot.cache.get_value(self.bot.poll_locations)), 3)
+
+class TestReadBookClubInfoMethods(unittest.TestCase):
+    def setUp(self):
+        self.bot = google_api.GoogleDocsBot.__new__(google_api.GoogleDocsBot)
+        self.sheet_ids = ['old sheet', 'new sheet']
+        self.forgotten = 0
+        self.bot.get_book_club_info_sheet_id = lambda: self.sheet_ids[min(self.forgotten, 1)]
+        self.bot.forget_book_club_info_sheet_id = self.forget
+
+    def tearDown(self):
+        del self.bot
+
+    def forget(self):
+        self.forgotten += 1
+
+    def read_function(self, status):
+        def read(sheet_id):
+            if sheet_id == 'old sheet':
+                RequestHTTP(status).execute()
+            return sheet_id
+        return read
+
+    def test_not_found(self):
+        self.assertEqual(self.bot.read_book_club_info(self.read_function(404)), 'new sheet')
+        self.assertEqual(self.forgotten, 1)
+
+    def test_other_error(self):
+        for status in (429, 503):
+            with self.assertRaises(errors.HttpError):
+                self.bot.read_book_club_info(self.read_function(status))
+        self.assertEqual(self.forgotten, 0)
+
+class TestReadRowsMethods(unittest.TestCase):
+    def setUp(self):
+        self.bot = google_api.GoogleDocsBot.__new__(google_api.GoogleDocsBot)
+        self.bot.executor = google_api.ThreadPoolExecutor(max_workers=1)
+        self.bot.service = FakeSheetsGet([[str(i)] for i in range(25)] + [[]])
+        self.bot.execute = lambda request, method_name: request
+        self.bot.get_sheet_row_counts = lambda: {'Sheet': 100}
+        self.bot.get_book_club_info_sheet_id = lambda: 'sheet'
+
+    def tearDown(self):
+        self.bot.executor.shutdown()
+        del self.bot
+
+    def test_read_rows(self):
+        rows = list(self.bot.read_rows('Sheet', 1))
+        self.assertEqual(rows, [[str(i)] for i in range(25)])
+
+    def test_shared_executor(self):
+        list(self.bot.read_rows('Sheet', 1))
+        list(self.bot.read_rows('Sheet', 1))
+        self.assertEqual(len(self.bot.service.threads), 1)
+
+class TestStaleWhileRevalidateMethods(unittest.TestCase):
+    def setUp(self):
+        self.bot = google_api.GoogleDocsBot.__new__(google_api.GoogleDocsBot)
+        self.bot.cache = google_api.Cache()
+        self.bot.refresh_executor = google_api.ThreadPoolExecutor(max_workers=1)
+        self.bot.refreshing = set()
+        self.bot.single_flight = google_api.SingleFlight()
+        self.bot.served_stale = False
+        self.bot.read_rows = lambda sheet_name, width: iter([['new user']])
+
+        self.bot.cache.set_value(self.bot.user_table, {'old user': ['old user']})
+        self.bot.cache.timeout_var(self.bot.user_table)
+
+    def tearDown(self):
+        self.bot.refresh_executor.shutdown()
+        del self.bot
+
+    def test_allow_stale(self):
+        self.assertEqual(self.bot.get_user_names(allow_stale=True), ['old user'])
+        self.assertTrue(self.bot.pop_stale_flag())
+        self.assertFalse(self.bot.pop_stale_flag())
+
+        self.bot.refresh_executor.shutdown()
+        self.assertEqual(self.bot.get_user_names(allow_stale=True), ['new user'])
+        self.assertFalse(self.bot.pop_stale_flag())
+
+    def test_user_info_allow_stale(self):
+        self.assertEqual(self.bot.get_user_info('old user', allow_stale=True), ['old user'])
+        self.assertTrue(self.bot.pop_stale_flag())
+
+    def test_no_stale(self):
+        self.assertEqual(self.bot.get_user_names(), ['new user'])
+        self.assertFalse(self.bot.pop_stale_flag())
+
+# Not sure how to write unit tests for the rest of the GoogleDocsBot class...
 
 if __name__ == '__main__':
     unittest.main()